@@ -1,4 +1,6 @@
+import datetime as _dt
 import enum as _enum
+import os as _os
 import tkinter as _tk
 import tkinter.filedialog as _fd
 import tkinter.messagebox as _msg
@@ -12,18 +14,21 @@ import logo
 import style
 import util
 import window
-from db_sqlite import Database
+from db_sqlite import get_db
 from tableview import TableView
 from tabs import Tabs
 
 __all__ = ["Admin"]
 _time_format = "%Y-%m-%d %H:%M"
+_report_buckets = {"День": "day", "Неделя": "week", "Час": "hour"}
+_report_groups = {"Фильм": "film", "Сеанс": "show", "Всего": "total"}
+_search_delay = 250
 
 
 class Admin(window.Window):
     def __init__(self):
         super().__init__("Панель администратора")
-        self._db = Database()
+        self._db = get_db()
         self._film_fields = [
             "Название",
             "Год",
@@ -32,6 +37,7 @@ class Admin(window.Window):
             "Изображение",
         ]
         self._film_editor = None
+        self._search_job = None
         self._create_widgets()
 
     def _create_widgets(self):
@@ -41,7 +47,9 @@ class Admin(window.Window):
             {
                 self._create_films: "Фильмы и сеансы",
                 self._create_stats: "Статистика",
+                self._create_reports: "Аналитика",
                 self._create_logins: "Кассиры",
+                self._create_diagnostics: "Диагностика",
             }
         )
 
@@ -55,9 +63,18 @@ class Admin(window.Window):
 
     def _create_films(self, master):
         frame = _ttk.Frame(master)
+        films = _ttk.Frame(frame)
+        films.pack(side="left", expand=True, fill="both", padx=10, pady=10)
 
-        self._film_view = filmview.FilmView(frame, self._db, self._on_film_select)
-        self._film_view.pack(side="left", expand=True, fill="both", padx=10, pady=10)
+        search = _ttk.Frame(films)
+        search.pack(pady=5)
+        _ttk.Label(search, text="Поиск").pack(side="left", padx=5)
+        self._film_query = style.Entry(search)
+        self._film_query.pack(side="left")
+        self._film_query.bind("<KeyRelease>", self._schedule_search)
+
+        self._film_view = filmview.FilmView(films, self._db, self._on_film_select)
+        self._film_view.pack(expand=True, fill="both")
 
         add_film = self._create_add_film_frame(frame)
         add_film.pack(side="right", expand=True, fill="y")
@@ -81,9 +98,37 @@ class Admin(window.Window):
         style.Button(frame, text="Добавить фильм", command=self._add_film).grid(
             column=0, row=len(widgets) + 2, columnspan=2, padx=5, pady=5
         )
+        style.Button(
+            frame, text="Импорт постеров из папки...", command=self._import_posters
+        ).grid(column=0, row=len(widgets) + 3, columnspan=2, padx=5, pady=5)
+
+        self._progress = _ttk.Progressbar(frame, length=200)
+        self._progress.grid(column=0, row=len(widgets) + 4, columnspan=2, pady=5)
+        self._progress.grid_remove()
 
         return frame
 
+    def _run_thumbnails(self, filenames, on_done):
+        """создать миниатюры в фоне, показывая прогресс"""
+        self._progress.config(maximum=len(filenames), value=0)
+        self._progress.grid()
+        util.poll_futures(
+            self,
+            images.submit_thumbnails(filenames),
+            lambda futures: self._on_thumbnails(futures, on_done),
+            lambda done, total: self._progress.config(value=done),
+        )
+
+    def _on_thumbnails(self, futures, on_done):
+        self._progress.grid_remove()
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception:
+                results.append(None)
+        on_done(results)
+
     def _create_show_editor(self, _):
         self._film_editor = win = _tk.Toplevel(self)
         win.title("Редактор сеансов")
@@ -91,12 +136,12 @@ class Admin(window.Window):
 
         columns = ["ID", "film_id", "Время"]
         self._shows = TableView(
-            win, self._db, "shows", columns, None, self._filter_shows
+            win, self._db, "shows", columns, where=self._filter_shows
         )
         self._shows.config(displaycolumns="Время")
         self._shows.column("#1", width=180)
         self._shows.update_data()
-        self._shows.grid(column=0, row=0, rowspan=6, sticky="nsew")
+        self._shows.grid(column=0, row=0, rowspan=11, sticky="nsew")
 
         _ttk.Label(win, text="Время сеанса").grid(column=1, row=0)
         self._show_time = style.Entry(win)
@@ -115,6 +160,19 @@ class Admin(window.Window):
             column=1, row=5
         )
 
+        _ttk.Label(win, text="Время сеансов на день (ЧЧ:ММ, ...)").grid(column=1, row=6)
+        self._schedule_times = style.Entry(win)
+        self._schedule_times.grid(column=1, row=7)
+
+        _ttk.Label(win, text="Количество дней").grid(column=1, row=8)
+        self._schedule_days = style.Entry(win)
+        self._schedule_days.insert(0, "30")
+        self._schedule_days.grid(column=1, row=9)
+
+        style.Button(win, text="Добавить расписание", command=self._add_schedule).grid(
+            column=1, row=10
+        )
+
     def _create_film_editor(self, data):
         self._film_editor = win = _tk.Toplevel(self)
         win.title("Редактирование фильма")
@@ -148,7 +206,7 @@ class Admin(window.Window):
             "logins",
             columns,
             self._on_cashier_select,
-            self._filter_logins,
+            where=[("role", "=", login.Roles.CASHIER.value)],
         )
         self._logins.config(displaycolumns=[columns[0]])
         self._logins.column("#1", width=180)
@@ -175,13 +233,141 @@ class Admin(window.Window):
         frame = _ttk.Frame(master)
 
         columns = ["ID", "Название", "Билетов продано", "Прибыль"]
-        stats = TableView(frame, self._db, "stats", columns)
-        stats.config(displaycolumns=[x for x in columns if x != "ID"])
-        stats.pack(expand=True, fill="both", padx=5, pady=5)
-        stats.update_data()
+        self._stats = TableView(frame, self._db, "stats_summary", columns)
+        self._stats.config(displaycolumns=[x for x in columns if x != "ID"])
+        self._stats.pack(expand=True, fill="both", padx=5, pady=5)
+        self._stats.update_data()
+
+        style.Button(frame, text="Пересчитать", command=self._rebuild_stats).pack(
+            pady=5
+        )
+
+        return frame
+
+    def _create_reports(self, master):
+        frame = _ttk.Frame(master)
+        frame.grid_columnconfigure(0, weight=1)
+        frame.grid_rowconfigure(0, weight=1)
+
+        columns = [
+            "Интервал",
+            "Фильм / сеанс",
+            "Сеансов",
+            "Мест",
+            "Продано",
+            "Выручка",
+            "Заполняемость, %",
+        ]
+        self._report = TableView(frame, columns=columns)
+        self._report.column("#2", width=300)
+        self._report.grid(column=0, row=0, rowspan=9, sticky="nsew", padx=5, pady=5)
+
+        today = dates.now().split()[0]
+        _ttk.Label(frame, text="С (ГГГГ-ММ-ДД)").grid(column=1, row=0)
+        self._report_start = style.Entry(frame)
+        self._report_start.insert(0, today)
+        self._report_start.grid(column=1, row=1, padx=5)
+
+        _ttk.Label(frame, text="По (ГГГГ-ММ-ДД)").grid(column=1, row=2)
+        self._report_end = style.Entry(frame)
+        self._report_end.insert(0, today)
+        self._report_end.grid(column=1, row=3, padx=5)
+
+        _ttk.Label(frame, text="Интервал").grid(column=1, row=4)
+        self._report_bucket = _ttk.Combobox(
+            frame, values=list(_report_buckets), state="readonly"
+        )
+        self._report_bucket.current(0)
+        self._report_bucket.grid(column=1, row=5, padx=5)
+
+        _ttk.Label(frame, text="Группировка").grid(column=1, row=6)
+        self._report_group = _ttk.Combobox(
+            frame, values=list(_report_groups), state="readonly"
+        )
+        self._report_group.current(0)
+        self._report_group.grid(column=1, row=7, padx=5)
+
+        style.Button(frame, text="Показать", command=self._show_report).grid(
+            column=1, row=8, pady=5
+        )
+
+        return frame
 
+    def _create_diagnostics(self, master):
+        frame = _ttk.Frame(master)
+        if self._db.profiler is None:
+            _ttk.Label(
+                frame, text="Замеры запросов выключены (переменная CINEMA_PROFILE)"
+            ).pack(pady=10)
+            return frame
+
+        columns = [
+            "Запрос",
+            "Вызовов",
+            "Всего, мс",
+            "Макс., мс",
+            "Медленных",
+            "Полный просмотр",
+            "План",
+        ]
+        self._diagnostics = TableView(frame, columns=columns)
+        self._diagnostics.column("#1", width=400, anchor="w")
+        self._diagnostics.column("#7", width=300, anchor="w")
+        self._diagnostics.pack(expand=True, fill="both", padx=5, pady=5)
+
+        buttons = _ttk.Frame(frame)
+        style.Button(buttons, text="Обновить", command=self._show_diagnostics).pack(
+            side="left", padx=5
+        )
+        style.Button(buttons, text="Сбросить", command=self._reset_diagnostics).pack(
+            side="left", padx=5
+        )
+        buttons.pack(pady=5)
+        _ttk.Label(
+            frame, text="Журнал медленных запросов: %s" % self._db.profiler.log_file
+        ).pack(pady=5)
+
+        self._show_diagnostics()
         return frame
 
+    def _show_diagnostics(self):
+        self._diagnostics.clear()
+        for sql, count, total, max_, slow, scan, plan in self._db.profiler.get_stats():
+            values = (sql, count, "%.1f" % total, "%.1f" % max_, slow)
+            values += ("да" if scan else "", plan)
+            self._diagnostics.insert("", "end", values=values)
+
+    def _reset_diagnostics(self):
+        self._db.profiler.reset()
+        self._show_diagnostics()
+
+    def _show_report(self):
+        start = dates.to_day(self._report_start.get_strip())
+        end = dates.to_day(self._report_end.get_strip())
+        if not start or not end or end < start:
+            return util.show_error("Введите период (ГГГГ-ММ-ДД)")
+
+        rows = self._db.get_report(
+            _dt.datetime.combine(start, _dt.time()),
+            _dt.datetime.combine(end + _dt.timedelta(days=1), _dt.time()),
+            _report_buckets[self._report_bucket.get()],
+            _report_groups[self._report_group.get()],
+        )
+
+        self._report.clear()
+        for bucket, key, shows, places, sold, profit in rows:
+            occupancy = round(100 * sold / places, 1) if places else 0
+            self._report.insert(
+                "", "end", values=(bucket, key, shows, places, sold, profit, occupancy)
+            )
+
+    def _rebuild_stats(self):
+        mismatches = self._db.rebuild_stats()
+        self._stats.update_data()
+        if mismatches:
+            return util.show_error("Статистика расходится с продажами: %s" % mismatches)
+        util.show_info("Статистика пересчитана")
+
     def _select_image(self, entry):
         filename = _fd.askopenfilename(filetypes=[("Картинки", ".jpg .png")])
         if not filename:
@@ -207,8 +393,6 @@ class Admin(window.Window):
             return util.show_error("Введите описание")
         if check_image and not data[4]:
             return util.show_error("Выберите картинку для фильма")
-        if check_image and not images.is_image(data[4]):
-            return util.show_error("Не удалось открыть картинку")
 
         return True
 
@@ -217,13 +401,49 @@ class Admin(window.Window):
             return
 
         fields = [e.get_strip() for e in self._film_entries]
-        if not self._db.add_film(*fields[:-1], images.create_thumbnail(fields[-1])):
+        self._run_thumbnails(
+            fields[-1:], lambda results: self._on_add_film(fields, results[0])
+        )
+
+    def _on_add_film(self, fields, image_data):
+        if image_data is None:
+            return util.show_error("Не удалось открыть картинку")
+        if not self._db.add_film(*fields[:-1], image_data):
             return util.show_error("Не удалось добавить фильм")
 
         util.show_info("Фильм добавлен")
-        self._film_view.update()
+        self._update_films()
         [e.delete(0, "end") for e in self._film_entries]
 
+    def _import_posters(self):
+        folder = _fd.askdirectory(title="Папка с постерами (имя файла - название)")
+        if not folder:
+            return
+
+        films = {film[1].casefold(): film for film in self._db.get_films()}
+        matched = {}
+        for name in sorted(_os.listdir(folder)):
+            film = films.get(_os.path.splitext(name)[0].casefold())
+            if images.is_image_file(name) and film is not None:
+                matched[_os.path.join(folder, name)] = film
+        if not matched:
+            return util.show_error("Не найдено картинок с названиями фильмов")
+
+        self._run_thumbnails(
+            list(matched),
+            lambda results: self._on_import_posters(list(matched.values()), results),
+        )
+
+    def _on_import_posters(self, films, results):
+        updated = 0
+        for film, image_data in zip(films, results):
+            if image_data is not None and self._db.update_film(*film[:5], image_data):
+                images.posters.discard(film[0])
+                updated += 1
+
+        self._update_films()
+        util.show_info("Обновлено постеров: %d из %d" % (updated, len(films)))
+
     def _add_show(self):
         show_time = self._show_time.get_strip()
         if not show_time or not dates.to_date(show_time):
@@ -242,6 +462,35 @@ class Admin(window.Window):
         self._show_time.delete(0, "end")
         self._shows.update_data()
 
+    def _add_schedule(self):
+        start = dates.to_date(self._show_time.get_strip())
+        if not start:
+            return util.show_error("Введите дату начала (ГГГГ-ММ-ДД ЧЧ:ММ)")
+
+        times = [t.strip() for t in self._schedule_times.get_strip().split(",")]
+        if not all(dates.to_date("%s %s" % (start, t)) for t in times):
+            return util.show_error("Введите время сеансов (ЧЧ:ММ, ЧЧ:ММ, ...)")
+
+        days = self._schedule_days.get_strip()
+        if not days.isdigit() or int(days) < 1:
+            return util.show_error("Введите количество дней (>0)")
+
+        price = self._ticket_price.get_strip()
+        if not price.isdigit() or int(price) < 0:
+            return util.show_error("Введите цену билета (>0)")
+
+        try:
+            shows, tickets = self._db.add_shows(
+                self._film_id, dates.schedule(start, int(days), times), price
+            )
+        except:
+            return util.show_error(
+                "Не удалось добавить расписание (возможно, время занято)"
+            )
+
+        util.show_info("Добавлено сеансов: %d, билетов: %d" % (shows, tickets))
+        self._shows.update_data()
+
     def _delete_show(self):
         if not self._shows.selection():
             return util.show_error("Выберите сеансы для удаления")
@@ -262,15 +511,24 @@ class Admin(window.Window):
         if not self._validate_film_data(self._edit_entries, bool(image_path)):
             return
 
+        film_id = self._film_id
         data = [e.get_strip() for e in self._edit_entries]
-        if image_path:
-            data[-1] = images.create_thumbnail(data[-1])
-        else:
-            data[-1] = None
+        if not image_path:
+            return self._on_update_film(film_id, data, None)
 
-        if self._db.update_film(self._film_id, *data):
+        self._run_thumbnails(
+            [image_path],
+            lambda results: self._on_update_film(film_id, data, results[0]),
+        )
+
+    def _on_update_film(self, film_id, data, image_data):
+        if data[-1] and image_data is None:
+            return util.show_error("Не удалось открыть картинку")
+
+        if self._db.update_film(film_id, *data[:-1], image_data):
+            images.posters.discard(film_id)
             util.show_info("Информация обновлена")
-            self._film_view.update()
+            self._update_films()
         else:
             util.show_error("Не удалось обновить фильм")
 
@@ -278,7 +536,8 @@ class Admin(window.Window):
         if not _msg.askyesno("Подтверждение", "Вы точно хотите удалить фильм?"):
             return
         self._db.delete_film(self._film_id)
-        self._film_view.update()
+        images.posters.discard(self._film_id)
+        self._update_films()
         self._film_editor.destroy()
         self._film_editor = None
 
@@ -308,6 +567,23 @@ class Admin(window.Window):
         self._db.change_user_password(login_, login.hash_pwd(password))
         util.show_info("Пароль кассира %s изменён" % login_)
 
+    def _schedule_search(self, _=None):
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(_search_delay, self._on_search)
+
+    def _on_search(self):
+        self._search_job = None
+        self._update_films()
+
+    def _update_films(self):
+        query = self._film_query.get_strip()
+        if not query:
+            return self._film_view.update()
+        ranked = self._db.search_films(query)
+        found = set(ranked)
+        self._film_view.update(lambda film: film[0] in found, ranked)
+
     def _on_film_select(self, data):
         if self._film_editor is not None:
             self._film_editor.destroy()
@@ -325,12 +601,5 @@ class Admin(window.Window):
         self._login.delete(0, "end")
         self._login.insert(0, selected["values"][0])
 
-    def _filter_shows(self, row):
-        if int(row[1]) == self._film_id:
-            return row
-        return None
-
-    def _filter_logins(self, row):
-        if row[2] == "cashier":
-            return row
-        return None
+    def _filter_shows(self):
+        return [("film_id", "=", self._film_id)]
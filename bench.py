@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""замеры скорости Database на сгенерированной базе без интерфейса:
+python3 bench.py --films 200 --days 90 --output new.json --compare old.json"""
+
+import argparse as _arg
+import datetime as _dt
+import json as _json
+import os as _os
+import platform as _platform
+import random as _random
+import sqlite3 as _sql
+import tempfile as _tmp
+import time as _time
+
+import dates
+from db_sqlite import Database
+
+__all__ = ["generate", "run", "summarize", "compare"]
+
+_day_start, _day_end = 9 * 60, 23 * 60
+_price = 300
+_repeat = 100
+# билетов в чеке замера sell_return
+_sell_count = 3
+# операция считается регрессией, если её p50 выросла больше чем на порог
+_threshold = 0.2
+
+
+def _day_times(shows_per_day):
+    """время сеансов одного дня ("ЧЧ:ММ"), равномерно с _day_start до _day_end"""
+    step = (_day_end - _day_start) // shows_per_day
+    return [
+        "%02d:%02d" % divmod(_day_start + i * step, 60) for i in range(shows_per_day)
+    ]
+
+
+def generate(
+    db, films=100, shows_per_day=5, days=30, sales_ratio=0.5, seed=1, poster=None
+):
+    """заполнить базу: films фильмов, shows_per_day сеансов в день за days
+    последних дней, продано sales_ratio билетов чеками по 1-4 билета.
+    poster(номер фильма) возвращает картинку, по умолчанию случайные байты.
+    Возвращает количество созданных строк"""
+    rnd = _random.Random(seed)
+    if poster is None:
+        poster = lambda _: rnd.randbytes(4096)
+    for i in range(films):
+        description = " ".join("слово%d" % rnd.randrange(1000) for _ in range(30))
+        db.add_film(
+            "Фильм %d" % i,
+            rnd.randint(1950, 2022),
+            rnd.randint(60, 180),
+            description,
+            poster(i),
+        )
+    film_ids = [film[0] for film in db.get_films()]
+
+    start = _dt.date.today() - _dt.timedelta(days=days)
+    by_film = {}
+    for time in dates.schedule(start, days, _day_times(shows_per_day)):
+        by_film.setdefault(rnd.choice(film_ids), []).append(time)
+    shows = tickets = 0
+    for film_id, times in by_film.items():
+        added = db.add_shows(film_id, times, _price)
+        shows, tickets = shows + added[0], tickets + added[1]
+
+    ticket_ids = [row[0] for row in db.execute("SELECT id FROM tickets")]
+    sold = rnd.sample(ticket_ids, int(len(ticket_ids) * sales_ratio))
+    checks = 0
+    with db.transaction():
+        while sold:
+            count = rnd.randint(1, 4)
+            db.checkout([(id_, _price) for id_ in sold[:count]])
+            sold = sold[count:]
+            checks += 1
+
+    return {
+        "films": len(film_ids),
+        "shows": shows,
+        "tickets": tickets,
+        "checks": checks,
+        "sales": int(len(ticket_ids) * sales_ratio),
+    }
+
+
+class _Context:
+    """случайные аргументы операций; проданные в замере билеты возвращаются,
+    поэтому база между замерами не меняется, кроме добавленных сеансов"""
+
+    def __init__(self, db, seed):
+        self.rnd = _random.Random(seed)
+        self.film_ids = [film[0] for film in db.get_films()]
+        self.days = [
+            row[0]
+            for row in db.execute("SELECT DISTINCT substr(time, 1, 10) FROM shows")
+        ]
+        last = db.execute("SELECT MAX(time) FROM shows").fetchone()[0]
+        self.next_show = dates.to_datetime(last) if last else _dt.datetime.now()
+        self.unsold = self._unsold(db)
+        if len(self.unsold) < _sell_count:
+            # все билеты проданы: продаётся и возвращается новый сеанс
+            db.add_show(self.film(), self.show_time(), _price)
+            self.unsold = self._unsold(db)
+
+    def _unsold(self, db):
+        return [
+            row[0]
+            for row in db.execute(
+                "SELECT id FROM tickets WHERE id NOT IN (SELECT ticket_id FROM sales)"
+            )
+        ]
+
+    def film(self):
+        return self.rnd.choice(self.film_ids)
+
+    def day(self):
+        return self.rnd.choice(self.days) if self.days else ""
+
+    def show_time(self):
+        self.next_show += _dt.timedelta(minutes=1)
+        return dates.from_date(self.next_show)
+
+
+def _sell_return(db, ctx):
+    items = [(id_, _price) for id_ in ctx.rnd.sample(ctx.unsold, _sell_count)]
+    check_id, _ = db.checkout(items)
+    db.return_sales([], [check_id])
+    return len(items)
+
+
+# название -> функция(db, ctx), возвращающая количество обработанных строк
+_operations = {
+    "get_table(films)": lambda db, ctx: len(db.get_table("films")),
+    "get_film_shows": lambda db, ctx: len(db.get_film_shows(ctx.film(), "")),
+    "get_film_shows(day)": lambda db, ctx: len(
+        db.get_film_shows(ctx.film(), ctx.day())
+    ),
+    "get_sold_tickets": lambda db, ctx: len(db.get_sold_tickets()),
+    "add_show": lambda db, ctx: db.add_show(ctx.film(), ctx.show_time(), _price),
+    "sell_return": _sell_return,
+    "stats": lambda db, ctx: len(db.get_table("stats")),
+    "stats_summary": lambda db, ctx: len(db.get_table("stats_summary")),
+}
+
+
+def _percentile(samples, q):
+    """q-й перцентиль отсортированных samples (ближайший ранг)"""
+    return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+def run(db, repeat=_repeat, seed=1):
+    """замерить каждую операцию repeat раз; время в миллисекундах"""
+    ctx = _Context(db, seed)
+    results = {}
+    for name, func in _operations.items():
+        samples, rows = [], 0
+        for _ in range(repeat):
+            start = _time.perf_counter()
+            rows += func(db, ctx)
+            samples.append(_time.perf_counter() - start)
+
+        total = sum(samples)
+        results[name] = summarize(samples)
+        results[name]["rows_per_s"] = rows / total if total else 0
+    return results
+
+
+def summarize(samples):
+    """количество, среднее и перцентили samples (секунды) в миллисекундах"""
+    samples = sorted(s * 1000 for s in samples)
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": _percentile(samples, 50),
+        "p90": _percentile(samples, 90),
+        "p99": _percentile(samples, 99),
+        "max": samples[-1],
+    }
+
+
+def compare(old, new, threshold=_threshold):
+    """операции, p50 которых в new больше, чем в old, более чем на threshold:
+    [(название, старое p50, новое p50), ...]"""
+    result = []
+    for name, stats in new.items():
+        if name not in old or not old[name]["p50"]:
+            continue
+        if stats["p50"] > old[name]["p50"] * (1 + threshold):
+            result.append((name, old[name]["p50"], stats["p50"]))
+    return result
+
+
+def _print_results(results):
+    print(
+        "%-22s %9s %9s %9s %9s %12s"
+        % ("операция", "p50, мс", "p90, мс", "p99, мс", "max, мс", "строк/с")
+    )
+    for name, r in results.items():
+        print(
+            "%-22s %9.3f %9.3f %9.3f %9.3f %12.0f"
+            % (name, r["p50"], r["p90"], r["p99"], r["max"], r["rows_per_s"])
+        )
+
+
+def _main():
+    parser = _arg.ArgumentParser(description="Замеры скорости базы кинотеатра")
+    parser.add_argument("--films", type=int, default=100)
+    parser.add_argument("--shows-per-day", type=int, default=5)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--sales-ratio", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=_repeat)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="файл базы (по умолчанию временный)")
+    parser.add_argument("--output", help="записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=_threshold)
+    args = parser.parse_args()
+    if args.films < 1 or args.shows_per_day < 1:
+        parser.error("нужны хотя бы один фильм и один сеанс в день")
+    if not 0 <= args.sales_ratio <= 1:
+        parser.error("--sales-ratio должен быть от 0 до 1")
+
+    config = {
+        "films": args.films,
+        "shows_per_day": args.shows_per_day,
+        "days": args.days,
+        "sales_ratio": args.sales_ratio,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+    with _tmp.TemporaryDirectory() as tmp:
+        filename = args.db or _os.path.join(tmp, "bench.sqlite3")
+        with Database(filename) as db:
+            start = _time.perf_counter()
+            rows = generate(
+                db,
+                args.films,
+                args.shows_per_day,
+                args.days,
+                args.sales_ratio,
+                args.seed,
+            )
+            generate_time = _time.perf_counter() - start
+            print("Сгенерировано за %.1f с: %s" % (generate_time, rows))
+            results = run(db, args.repeat, args.seed)
+
+    _print_results(results)
+    report = {
+        "config": config,
+        "rows": rows,
+        "generate_seconds": generate_time,
+        "python": _platform.python_version(),
+        "sqlite": _sql.sqlite_version,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            _json.dump(report, f, indent=4, ensure_ascii=False)
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        old = _json.load(f)
+    if old.get("config") != config:
+        print("Внимание: параметры запусков отличаются")
+    regressions = compare(old["results"], results, args.threshold)
+    for name, before, after in regressions:
+        print("Регрессия: %s, p50 %.3f -> %.3f мс" % (name, before, after))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
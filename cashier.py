@@ -1,28 +1,36 @@
 import functools as _ft
+import sqlite3 as _sql
 import tkinter as _tk
 import tkinter.messagebox as _msg
 import tkinter.ttk as _ttk
 
+import filmindex
 import filmview
 import login
 import logo
 import style
 import util
-from db_sqlite import Database
+from db_sqlite import get_db
 from tableview import TableView
 from tabs import Tabs
 from window import Window
 
 __all__ = ["Cashier"]
+_page_size = 100
+_tile_height = 200
+_search_delay = 250
+_search_limit = 100
 
 
 class Cashier(Window):
     def __init__(self):
         super().__init__("Продажа билетов")
-        self._db = Database()
+        self._db = get_db()
+        self._film_index = filmindex.FilmIndex(self._db)
+        self._search_job = None
         self._show_selector = self._ticket_selector = None
-        self._tickets_to_sell = []
-        self._update_sold_tickets()
+        # id билета -> цена
+        self._tickets_to_sell = {}
 
         self._create_widgets()
 
@@ -42,16 +50,17 @@ class Cashier(Window):
         frame.grid_columnconfigure(1, weight=2)
         frame.grid_rowconfigure(1, weight=1)
 
-        self._film_view = filmview.FilmView(frame, self._db, self._on_film_select)
+        self._film_view = filmview.FilmView(
+            frame, self._db, self._on_film_select, _tile_height
+        )
         self._film_view.grid(column=0, row=1)
         self._reset_search()
 
         search = self._create_search(frame)
         search.grid(column=0, row=2)
 
-        self._check_text = _ttk.Label(frame)
+        self._check_text = _ttk.Label(frame, text="Новый чек")
         self._check_text.grid(column=1, row=0)
-        self._update_check_id()
 
         self._check = TableView(frame, columns=["ID", "Билет", "Стоимость"])
         self._check.config(displaycolumns=["Билет", "Стоимость"])
@@ -76,6 +85,9 @@ class Cashier(Window):
         self._show_time = style.Entry(frame)
         self._show_time.grid(column=1, row=1, pady=5)
 
+        for entry in (self._film_name, self._show_time):
+            entry.bind("<KeyRelease>", self._schedule_search)
+
         style.Button(frame, text="Поиск", command=self._on_search).grid(
             column=0, row=2, columnspan=2, pady=5
         )
@@ -117,21 +129,52 @@ class Cashier(Window):
         frame.grid_columnconfigure(1, weight=2)
         frame.grid_rowconfigure(0, weight=1)
 
-        self._checks = TableView(frame, self._db, "checks", ["ID чека", "Сумма"])
+        self._checks = TableView(
+            frame,
+            self._db,
+            "checks",
+            ["ID чека", "Сумма"],
+            incremental=True,
+            page_size=_page_size,
+        )
         self._checks.grid(column=0, row=0, sticky="nsew", padx=5, pady=5)
 
         sales_cols = ["ID", "ID чека", "Билет", "Стоимость"]
-        self._sales = TableView(frame, self._db, "sales", sales_cols)
+        self._sales = TableView(
+            frame,
+            self._db,
+            "sales_names",
+            sales_cols,
+            incremental=True,
+            page_size=_page_size,
+        )
         self._sales.config(displaycolumns=[x for x in sales_cols if x != "ID"])
+        self._sales.column("Билет", width=300)
         self._sales.grid(column=1, row=0, sticky="nsew", padx=5, pady=5)
         self._update_sales()
 
+        find_check = _ttk.Frame(frame)
+        _ttk.Label(find_check, text="Чек №").pack(side="left", padx=5)
+        self._find_check_id = style.Entry(find_check)
+        self._find_check_id.pack(side="left")
+        style.Button(find_check, text="Найти", command=self._on_find_check).pack(
+            side="left", padx=5
+        )
+        find_check.grid(column=0, row=1, pady=5)
+
         style.Button(frame, text="Вернуть", command=self._on_return_sales).grid(
-            column=0, row=1, columnspan=2, pady=5
+            column=0, row=2, columnspan=2, pady=5
         )
 
         return frame
 
+    def _on_find_check(self):
+        check_id = self._find_check_id.get_strip()
+        if not check_id.isdigit():
+            return util.show_error("Введите номер чека")
+        if not self._checks.jump_to(int(check_id)):
+            util.show_error("Чек №%s не найден" % check_id)
+
     def _on_film_select(self, data):
         self._close_show_selector()
         self._close_ticket_selector()
@@ -143,7 +186,12 @@ class Cashier(Window):
         _ttk.Label(win, text=data[1]).pack()
         columns = ["ID", "film_id", "Время"]
         self._shows = TableView(
-            win, self._db, "shows", columns, self._select_ticket, self._filter_shows
+            win,
+            self._db,
+            "shows",
+            columns,
+            self._select_ticket,
+            where=self._filter_shows,
         )
         self._shows.config(displaycolumns="Время")
         self._shows.column("#1", width=180)
@@ -159,10 +207,8 @@ class Cashier(Window):
             self._show_selector.destroy()
             self._show_selector = None
 
-    def _filter_shows(self, row):
-        if int(row[1]) == self._film_id and self._time in row[2]:
-            return row
-        return None
+    def _filter_shows(self):
+        return [("film_id", "=", self._film_id), ("time", "prefix", self._time)]
 
     def _select_ticket(self, _, selected):
         self._close_show_selector()
@@ -180,6 +226,7 @@ class Cashier(Window):
     def _create_ticket_buttons(self, master):
         frame = _ttk.Frame(master)
 
+        sold = self._db.get_show_seat_map(self._show_id)
         column, row = 0, 0
         for id_, price, place in self._db.get_show_tickets(self._show_id):
             btn = style.Button(frame, text="м. %d, %d р." % (place, price))
@@ -188,7 +235,7 @@ class Cashier(Window):
             )
             btn.grid(column=column, row=row)
 
-            if self._is_sold(id_):
+            if place in sold or id_ in self._tickets_to_sell:
                 btn.config(state="disabled")
 
             column += 1
@@ -208,33 +255,32 @@ class Cashier(Window):
             self._ticket_selector.destroy()
             self._ticket_selector = None
 
-    def _is_sold(self, id_):
-        return id_ in self._tickets_to_sell or id_ in self._sold_tickets
-
     def _add_ticket(self, id_, price, place):
         self._close_ticket_selector()
 
-        self._tickets_to_sell.append(id_)
+        self._tickets_to_sell[id_] = price
         name = self._db.get_ticket_name(id_)
-        self._check.insert("", "end", values=(id_, name, price))
+        self._check.insert("", "end", iid=id_, values=(id_, name, price))
         self._update_check_sum()
 
     def _on_sell(self):
-        if len(self._check.get_children()) == 0:
+        if not self._tickets_to_sell:
             return util.show_error("В чеке нет товаров")
 
-        self._db.add_check(self._check_id, self._check_sum)
-        for row in self._check.get_children():
-            values = self._check.item(row)["values"]
-            self._db.sell_ticket(self._check_id, values[0], values[2])
+        try:
+            check_id, sum_ = self._db.checkout(self._tickets_to_sell.items())
+        except _sql.IntegrityError:
+            return util.show_error("Некоторые билеты уже проданы")
+        except _sql.OperationalError:
+            # база занята другой кассой дольше времени ожидания
+            return util.show_error("База данных занята, попробуйте ещё раз")
 
         self._tickets_to_sell.clear()
-        self._update_sold_tickets()
         self._check.clear()
-        self._db.save()
 
-        util.show_info("Чек №%d на сумму %d" % (self._check_id, self._check_sum))
-        self._update_check_id()
+        # номер чека известен только после записи в базу
+        self._check_text.config(text="Новый чек (предыдущий: №%d)" % check_id)
+        util.show_info("Чек №%d на сумму %d" % (check_id, sum_))
         self._update_check_sum()
         self._update_sales()
 
@@ -258,8 +304,7 @@ class Cashier(Window):
             return util.show_error("Выберите билеты для возврата")
 
         for row in self._check.selection():
-            values = self._check.item(row)["values"]
-            self._tickets_to_sell.remove(values[0])
+            del self._tickets_to_sell[int(row)]
             self._check.delete(row)
 
         self._update_check_sum()
@@ -267,64 +312,38 @@ class Cashier(Window):
     def _on_return_sales(self):
         if not self._checks.selection() and not self._sales.selection():
             return util.show_error("Выберите хотя бы один чек или билет для возврата")
-        selected_sales = list(self._sales.selection())
-
-        for check in self._checks.selection():
-            check_id = self._checks.item(check)["values"][0]
-            selected_sales += self._find_sales(check_id)
-        selected_sales = set(selected_sales)
+        # строки таблиц чеков и продаж имеют id записей в качестве ключей
+        sale_ids = [int(x) for x in self._sales.selection()]
+        check_ids = [int(x) for x in self._checks.selection()]
 
         if not _msg.askyesno(
             "Подтверждение",
             "Вернуть чеков: %d, товаров: %d?"
-            % (len(self._checks.selection()), len(selected_sales)),
+            % (len(check_ids), self._db.count_sales(sale_ids, check_ids)),
         ):
             return
 
-        for sale in selected_sales:
-            # ID записи в первом столбце (скрытом)
-            values = self._sales.item(sale)["values"]
-            self._db.return_sale(values[0])
-
-        for check in self._checks.selection():
-            values = self._checks.item(check)["values"]
-            self._db.return_check(values[0])
-
+        self._db.return_sales(sale_ids, check_ids)
         self._update_sales()
-        self._update_check_id()
-        self._update_sold_tickets()
-
-    def _find_sales(self, check_id):
-        result = []
-        for row in self._sales.get_children():
-            values = self._sales.item(row)["values"]
-            if values[1] == check_id:
-                result.append(row)
-        return result
-
-    def _update_check_id(self):
-        self._check_id = self._db.get_new_check_id()
-        self._check_text.config(text="Чек №%d" % self._check_id)
 
     def _update_check_sum(self):
-        result = 0
-        for row in self._check.get_children():
-            result += self._check.item(row)["values"][2]
-        self._check_sum = result
+        self._check_sum = sum(self._tickets_to_sell.values())
         self._sum_label.config(text="Сумма: %d" % self._check_sum)
 
-    def _update_sold_tickets(self):
-        self._sold_tickets = self._db.get_sold_tickets()
-        self._sold_tickets = [item[0] for item in self._sold_tickets]
-
     def _update_sales(self):
         self._checks.update_data()
         self._sales.update_data()
 
+    def _schedule_search(self, _=None):
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(_search_delay, self._on_search)
+
     def _on_search(self):
+        self._search_job = None
         self._name2 = self._film_name.get_strip()
         self._time = self._show_time.get_strip()
-        self._film_view.update(self._filter_films)
+        self._update_films()
 
     def _reset_search(self):
         if hasattr(self, "_film_name"):
@@ -332,9 +351,16 @@ class Cashier(Window):
             self._show_time.delete(0, "end")
 
         self._name2, self._time = "", ""
-        self._film_view.update(self._filter_films)
+        self._update_films()
+
+    def _update_films(self):
+        self._film_index.refresh()
+        self._found_films = self._film_index.search(self._name2, self._time)
+        # полнотекстовый поиск добавляет совпадения по описанию и ранжирует
+        ranked = self._db.search_films(self._name2, _search_limit)
+        if ranked:
+            self._found_films |= set(ranked) & self._film_index.search("", self._time)
+        self._film_view.update(self._filter_films, ranked)
 
     def _filter_films(self, film):
-        if not self._db.get_film_shows(film[0], self._time):
-            return False
-        return self._name2.lower() in film[1].lower()
+        return film[0] in self._found_films
@@ -1,6 +1,14 @@
 import datetime as _dt
 
 _date_format = "%Y-%m-%d %H:%M"
+_day_format = "%Y-%m-%d"
+
+# интервалы отчётов: шаг и формат подписи (совпадает с db_sqlite._report_buckets)
+_buckets = {
+    "hour": (_dt.timedelta(hours=1), "%Y-%m-%d %H"),
+    "day": (_dt.timedelta(days=1), _day_format),
+    "week": (_dt.timedelta(weeks=1), _day_format),
+}
 
 
 def to_date(s):
@@ -10,9 +18,64 @@ def to_date(s):
         return None
 
 
+def to_datetime(s):
+    try:
+        return _dt.datetime.strptime(s, _date_format)
+    except ValueError:
+        return None
+
+
+def to_day(s):
+    try:
+        return _dt.datetime.strptime(s, _day_format).date()
+    except ValueError:
+        return None
+
+
 def from_date(date):
     return date.strftime(_date_format)
 
 
 def now():
     return _dt.datetime.now().strftime(_date_format)
+
+
+def schedule(start, days, times):
+    """строки времени сеансов: каждое время из times ("ЧЧ:ММ") на days дней,
+    начиная с даты start"""
+    result = []
+    for day in range(days):
+        date = start + _dt.timedelta(days=day)
+        result += ["%s %s" % (date.isoformat(), t) for t in times]
+    return result
+
+
+def prefix_range(prefix):
+    """границы [lo, hi) строк времени, начинающихся с prefix"""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def bucket_start(moment, kind):
+    """начало интервала kind ("hour", "day", "week" с понедельника),
+    в который попадает moment (datetime)"""
+    if kind == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind == "week":
+        moment -= _dt.timedelta(days=moment.weekday())
+    return moment
+
+
+def bucket_label(moment, kind):
+    return bucket_start(moment, kind).strftime(_buckets[kind][1])
+
+
+def buckets(start, end, kind):
+    """интервалы [начало, конец) вида kind, покрывающие [start, end)"""
+    step = _buckets[kind][0]
+    result = []
+    moment = bucket_start(start, kind)
+    while moment < end:
+        result.append((moment, moment + step))
+        moment += step
+    return result
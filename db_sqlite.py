@@ -1,17 +1,64 @@
+import contextlib as _ctx
+import hashlib as _hash
+import json as _json
+import re as _re
 import sqlite3 as _sql
+import threading as _th
+import time as _time
 
-__all__ = ["Database"]
+import dates
+
+__all__ = ["Database", "init_db", "get_db", "close_db"]
 
 _default_name = "files/cinema.sqlite3"
+_busy_timeout = 10
+# размер кэша подготовленных запросов каждого соединения
+_statement_cache = 256
+# PRAGMA каждого соединения; отрицательный cache_size - в КиБ
+_pragmas = {
+    "foreign_keys": 1,
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
 _cinema_places = 20
+_film_columns = "id, name, year, duration_min, description, poster"
+# вариант картинки, который хранится в posters.data
+_main_variant = "medium"
+
+
+def _poster_hash(data):
+    return _hash.sha256(data).hexdigest()
+
+
+_operators = ["=", "!=", "<", "<=", ">", ">="]
+
 
+def _where_clause(conditions):
+    """условия [(столбец, оператор, значение), ...] -> (выражение, параметры);
+    оператор "prefix" выбирает строки, начинающиеся со значения"""
+    parts, args = [], []
+    for column, op, value in conditions:
+        if op == "prefix":
+            if value:
+                parts.append("%s >= ? AND %s < ?" % (column, column))
+                args += dates.prefix_range(value)
+        elif op in _operators:
+            parts.append("%s %s ?" % (column, op))
+            args.append(value)
+        else:
+            raise ValueError("Unknown operator: %s" % op)
+
+    return " AND ".join(parts), args
+
+
+# исходная схема; всё добавленное позже создаётся миграциями (_migrations),
+# schema_migrations нужна до их запуска
 _init_script = (
     """
 PRAGMA encoding = "UTF-8";
-PRAGMA foreign_keys = 1;
-
 PRAGMA journal_mode = WAL;
-PRAGMA synchronous = NORMAL;
 
 CREATE TABLE IF NOT EXISTS films (
     id INTEGER PRIMARY KEY,
@@ -65,10 +112,315 @@ INNER JOIN shows ON tickets.show_id = shows.id
 INNER JOIN films ON shows.film_id = films.id
 GROUP BY films.id
 ORDER BY profit DESC;
+
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied TEXT NOT NULL,
+    seconds REAL NOT NULL
+) STRICT;
 """
     % _cinema_places
 )
 
+_names_script = """
+CREATE VIEW IF NOT EXISTS ticket_names AS
+SELECT tickets.id as id, printf('%s (%s, м. %d)', films.name, shows.time, tickets.place) as name
+FROM tickets
+INNER JOIN shows ON tickets.show_id = shows.id
+INNER JOIN films ON shows.film_id = films.id;
+
+CREATE VIEW IF NOT EXISTS sales_names AS
+SELECT sales.id as id, sales.check_id as check_id, ticket_names.name as ticket, sales.cost as cost
+FROM sales
+INNER JOIN ticket_names ON sales.ticket_id = ticket_names.id;
+"""
+
+# журнал изменённых строк для инкрементального обновления TableView
+_tracked_tables = ["checks", "sales", "shows", "films"]
+# представления, изменения которых отслеживаются по их основной таблице
+_tracked_views = {"sales_names": "sales"}
+# миграция, пересоздающая одну из этих таблиц, должна создать и триггеры
+_changes_script = """
+CREATE TABLE IF NOT EXISTS row_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    tbl TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    UNIQUE(tbl, row_id)
+) STRICT;
+
+-- изменения одной таблицы после версии читаются по диапазону индекса
+CREATE INDEX IF NOT EXISTS row_changes_tbl_seq ON row_changes(tbl, seq);
+"""
+_trigger_template = """
+CREATE TRIGGER IF NOT EXISTS %(table)s_%(event)s_changes AFTER %(event)s ON %(table)s
+BEGIN
+    INSERT OR REPLACE INTO row_changes (tbl, row_id) VALUES ('%(table)s', %(row)s.id);
+END;
+"""
+for _table in _tracked_tables:
+    for _event, _row in [("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")]:
+        _changes_script += _trigger_template % {
+            "table": _table,
+            "event": _event,
+            "row": _row,
+        }
+
+# сводная статистика продаж по фильмам и по дням сеансов, поддерживается
+# триггерами; при каскадном удалении сеанса билеты и сеанс к моменту удаления
+# продаж уже удалены, поэтому сеанс вычитает свои продажи сам
+_stats_script = """
+CREATE TABLE IF NOT EXISTS film_stats (
+    film_id INTEGER PRIMARY KEY,
+    tickets INTEGER NOT NULL DEFAULT 0,
+    profit INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY(film_id) REFERENCES films(id) ON DELETE CASCADE
+) STRICT;
+
+CREATE TABLE IF NOT EXISTS film_day_stats (
+    film_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    tickets INTEGER NOT NULL DEFAULT 0,
+    profit INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(film_id, day),
+    FOREIGN KEY(film_id) REFERENCES films(id) ON DELETE CASCADE
+) STRICT, WITHOUT ROWID;
+
+CREATE VIEW IF NOT EXISTS stats_summary AS
+SELECT films.id as id, films.name as name, film_stats.tickets as tickets, film_stats.profit as profit
+FROM film_stats
+INNER JOIN films ON film_stats.film_id = films.id
+WHERE film_stats.tickets > 0
+ORDER BY profit DESC;
+
+CREATE TRIGGER IF NOT EXISTS sales_insert_stats AFTER INSERT ON sales
+BEGIN
+    INSERT INTO film_stats (film_id, tickets, profit)
+    SELECT shows.film_id, 1, NEW.cost FROM tickets
+    INNER JOIN shows ON tickets.show_id = shows.id
+    WHERE tickets.id = NEW.ticket_id
+    ON CONFLICT(film_id) DO UPDATE SET
+        tickets = tickets + 1, profit = profit + excluded.profit;
+
+    INSERT INTO film_day_stats (film_id, day, tickets, profit)
+    SELECT shows.film_id, substr(shows.time, 1, 10), 1, NEW.cost FROM tickets
+    INNER JOIN shows ON tickets.show_id = shows.id
+    WHERE tickets.id = NEW.ticket_id
+    ON CONFLICT(film_id, day) DO UPDATE SET
+        tickets = tickets + 1, profit = profit + excluded.profit;
+END;
+
+CREATE TRIGGER IF NOT EXISTS sales_delete_stats AFTER DELETE ON sales
+BEGIN
+    UPDATE film_stats SET tickets = tickets - 1, profit = profit - OLD.cost
+    WHERE film_id = (
+        SELECT shows.film_id FROM tickets
+        INNER JOIN shows ON tickets.show_id = shows.id
+        WHERE tickets.id = OLD.ticket_id
+    );
+
+    UPDATE film_day_stats SET tickets = tickets - 1, profit = profit - OLD.cost
+    WHERE (film_id, day) = (
+        SELECT shows.film_id, substr(shows.time, 1, 10) FROM tickets
+        INNER JOIN shows ON tickets.show_id = shows.id
+        WHERE tickets.id = OLD.ticket_id
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS shows_delete_stats BEFORE DELETE ON shows
+BEGIN
+    UPDATE film_stats SET
+        tickets = tickets - sold.count, profit = profit - sold.sum
+    FROM (
+        SELECT COUNT(*) as count, COALESCE(SUM(cost), 0) as sum FROM sales
+        INNER JOIN tickets ON sales.ticket_id = tickets.id
+        WHERE tickets.show_id = OLD.id
+    ) as sold
+    WHERE film_id = OLD.film_id;
+
+    UPDATE film_day_stats SET
+        tickets = tickets - sold.count, profit = profit - sold.sum
+    FROM (
+        SELECT COUNT(*) as count, COALESCE(SUM(cost), 0) as sum FROM sales
+        INNER JOIN tickets ON sales.ticket_id = tickets.id
+        WHERE tickets.show_id = OLD.id
+    ) as sold
+    WHERE film_id = OLD.film_id AND day = substr(OLD.time, 1, 10);
+END;
+"""
+
+_rebuild_stats_script = """
+DELETE FROM film_stats;
+DELETE FROM film_day_stats;
+
+INSERT INTO film_day_stats (film_id, day, tickets, profit)
+SELECT shows.film_id, substr(shows.time, 1, 10), COUNT(*), SUM(cost) FROM sales
+INNER JOIN tickets ON sales.ticket_id = tickets.id
+INNER JOIN shows ON tickets.show_id = shows.id
+GROUP BY shows.film_id, substr(shows.time, 1, 10);
+
+INSERT INTO film_stats (film_id, tickets, profit)
+SELECT film_id, SUM(tickets), SUM(profit) FROM film_day_stats GROUP BY film_id;
+"""
+
+# подписи интервалов отчётов (совпадают с dates.bucket_label)
+_report_buckets = {
+    "hour": "substr(shows.time, 1, 13)",
+    "day": "substr(shows.time, 1, 10)",
+    "week": "date(shows.time, '-6 days', 'weekday 1')",
+}
+# группировка отчётов: (подпись строки, GROUP BY)
+_report_groups = {
+    "film": ("films.name", ", shows.film_id"),
+    "show": ("printf('%s (%s)', films.name, shows.time)", ", shows.id"),
+    "total": ("''", ""),
+}
+_report_query = """
+SELECT %s as bucket, %s as key, COUNT(DISTINCT shows.id), COUNT(tickets.id),
+    COUNT(sales.id), COALESCE(SUM(sales.cost), 0)
+FROM shows
+INNER JOIN films ON shows.film_id = films.id
+INNER JOIN tickets ON tickets.show_id = shows.id
+LEFT JOIN sales ON sales.ticket_id = tickets.id
+WHERE shows.time >= ? AND shows.time < ?
+GROUP BY bucket%s
+ORDER BY bucket, key
+"""
+# интервалов в кэше отчётов, давно не запрашивавшиеся вытесняются
+_report_cache_size = 2000
+
+# картинки хранятся один раз по хешу содержимого и удаляются вместе
+# с последним фильмом, который на них ссылается
+_posters_script = """
+CREATE INDEX IF NOT EXISTS films_poster ON films(poster);
+
+CREATE TRIGGER IF NOT EXISTS films_delete_poster AFTER DELETE ON films
+BEGIN
+    DELETE FROM posters WHERE hash = OLD.poster
+    AND NOT EXISTS (SELECT 1 FROM films WHERE poster = OLD.poster);
+END;
+
+CREATE TRIGGER IF NOT EXISTS films_update_poster AFTER UPDATE OF poster ON films
+WHEN OLD.poster IS NOT NEW.poster
+BEGIN
+    DELETE FROM posters WHERE hash = OLD.poster
+    AND NOT EXISTS (SELECT 1 FROM films WHERE poster = OLD.poster);
+END;
+"""
+
+# перенос картинок из столбца films.image в таблицу posters
+_posters_migration_script = """
+CREATE TABLE IF NOT EXISTS posters (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+) STRICT;
+CREATE TABLE IF NOT EXISTS poster_variants (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    data BLOB NOT NULL,
+    UNIQUE(hash, variant),
+    FOREIGN KEY(hash) REFERENCES posters(hash) ON DELETE CASCADE
+) STRICT;
+ALTER TABLE films ADD COLUMN poster TEXT REFERENCES posters(hash);
+INSERT OR IGNORE INTO posters SELECT sha256(image), image FROM films;
+UPDATE films SET poster = sha256(image);
+ALTER TABLE films DROP COLUMN image
+"""
+
+# полнотекстовый поиск по названиям и описаниям фильмов. unicode61 не
+# сводит ё к е, поэтому в индекс попадает текст с заменой ё на е; сам текст
+# хранится только в films (content='')
+_fts_text = "replace(replace(%s, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _fts_values(row):
+    """значения (rowid, name, description) строки фильма row для films_fts"""
+    return "%s.id, %s, %s" % (
+        row,
+        _fts_text % (row + ".name"),
+        _fts_text % (row + ".description"),
+    )
+
+
+_fts_script = """
+CREATE VIRTUAL TABLE IF NOT EXISTS films_fts USING fts5(
+    name, description, content='', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS films_insert_fts AFTER INSERT ON films
+BEGIN
+    INSERT INTO films_fts (rowid, name, description) VALUES (%(new)s);
+END;
+
+CREATE TRIGGER IF NOT EXISTS films_delete_fts AFTER DELETE ON films
+BEGIN
+    INSERT INTO films_fts (films_fts, rowid, name, description)
+    VALUES ('delete', %(old)s);
+END;
+
+CREATE TRIGGER IF NOT EXISTS films_update_fts AFTER UPDATE OF name, description ON films
+BEGIN
+    INSERT INTO films_fts (films_fts, rowid, name, description)
+    VALUES ('delete', %(old)s);
+    INSERT INTO films_fts (rowid, name, description) VALUES (%(new)s);
+END;
+""" % {
+    "new": _fts_values("NEW"),
+    "old": _fts_values("OLD"),
+}
+_fill_fts_script = (
+    "INSERT INTO films_fts (rowid, name, description) SELECT %s FROM films"
+    % _fts_values("films")
+)
+# вес названия в ранжировании bm25 относительно описания
+_fts_name_weight = 10.0
+
+# миграции схемы по порядку, PRAGMA user_version - количество применённых.
+# Миграция name - метод _migrate_<name>, выполняется в своей транзакции
+# после _init_script; новые объекты схемы добавляются только новой миграцией
+# в конец списка
+_migrations = [
+    "indexes",
+    "posters",
+    "checks_autoincrement",
+    "films_fts",
+    "film_stats",
+    "row_changes",
+    "names",
+]
+
+_indexes_script = """
+CREATE INDEX IF NOT EXISTS shows_film_time ON shows(film_id, time);
+CREATE INDEX IF NOT EXISTS tickets_show ON tickets(show_id);
+CREATE INDEX IF NOT EXISTS sales_check ON sales(check_id);
+CREATE INDEX IF NOT EXISTS logins_role ON logins(role)
+"""
+
+# id чеков не должны повторяться после удаления последнего чека
+_checks_autoincrement_script = """
+CREATE TABLE checks_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sum INTEGER NOT NULL DEFAULT 0 CHECK(sum >= 0)
+) STRICT;
+INSERT INTO checks_new SELECT id, sum FROM checks;
+DROP TABLE checks;
+ALTER TABLE checks_new RENAME TO checks
+"""
+
+
+def _run_script(cur, script):
+    """выполнить запросы script по одному: executescript завершил бы
+    текущую транзакцию. Точки с запятой внутри триггеров не разделяют
+    запросы"""
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if _sql.complete_statement(statement):
+            cur.execute(statement)
+            statement = ""
+
+
 _exit_script = """
 PRAGMA analysis_limit = 1000;
 PRAGMA optimize;
@@ -76,26 +428,348 @@ PRAGMA optimize;
 
 
 class Database:
-    def __init__(self, filename=_default_name):
-        self._con = _sql.connect(filename)
+    def __init__(
+        self,
+        filename=_default_name,
+        pragmas=None,
+        statement_cache=None,
+        profiler=None,
+    ):
+        """pragmas дополняют и заменяют _pragmas, statement_cache - размер
+        кэша запросов на соединение, profiler - dbprofile.QueryProfiler для
+        замеров всех запросов. Схема создаётся и обновляется здесь, поэтому
+        в процессе лучше держать одну базу (см. init_db)"""
+        self._filename = filename
+        self.profiler = profiler
+        self._pragmas = dict(_pragmas, **(pragmas or {}))
+        self._statement_cache = statement_cache or _statement_cache
+        self._thread = _th.get_ident()
+        self._local = _th.local()
+        self._readers = []
+        self._readers_lock = _th.Lock()
+        self._con = self._connect()
         self._cur = self._con.cursor()
+        self._init_schema()
+        self._report_cache, self._report_version = {}, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _connect(self, **kwargs):
+        connect = _sql.connect if self.profiler is None else self.profiler.connect
+        con = connect(
+            self._filename,
+            timeout=_busy_timeout,
+            cached_statements=self._statement_cache,
+            **kwargs
+        )
+        for name, value in self._pragmas.items():
+            con.execute("PRAGMA %s = %s" % (name, value))
+        return con
+
+    def _init_schema(self):
         self._cur.executescript(_init_script)
+        self._migrate()
+
+    def _migrate(self):
+        """применить миграции новее PRAGMA user_version, каждую в своей
+        транзакции; время применения записывается в schema_migrations"""
+        version = self._cur.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(_migrations):
+            return
+
+        # внешние ключи отключаются, чтобы пересоздание таблиц не удаляло
+        # каскадом связанные строки; целостность проверяется перед сохранением
+        self._cur.execute("PRAGMA foreign_keys = 0")
+        try:
+            for number, name in enumerate(_migrations[version:], version + 1):
+                start = _time.perf_counter()
+                with self.transaction() as cur:
+                    getattr(self, "_migrate_" + name)(cur)
+                    if cur.execute("PRAGMA foreign_key_check").fetchone():
+                        raise _sql.IntegrityError("Migration %s: foreign key" % name)
+                    cur.execute("PRAGMA user_version = %d" % number)
+                    cur.execute(
+                        "INSERT OR REPLACE INTO schema_migrations VALUES (?, ?, ?, ?)",
+                        (number, name, dates.now(), _time.perf_counter() - start),
+                    )
+        finally:
+            self._cur.execute(
+                "PRAGMA foreign_keys = %s" % self._pragmas["foreign_keys"]
+            )
 
-    def __del__(self):
-        self._cur.executescript(_exit_script)
+    def _migrate_indexes(self, cur):
+        _run_script(cur, _indexes_script)
+
+    def _migrate_posters(self, cur):
+        """перенос картинок из столбца films.image в таблицу posters"""
+        if "image" in self.get_columns("films"):
+            self._con.create_function("sha256", 1, _poster_hash, deterministic=True)
+            _run_script(cur, _posters_migration_script)
+        _run_script(cur, _posters_script)
+
+    def _migrate_checks_autoincrement(self, cur):
+        cur.execute("SELECT sql FROM sqlite_schema WHERE name = 'checks'")
+        if "AUTOINCREMENT" not in cur.fetchone()[0]:
+            _run_script(cur, _checks_autoincrement_script)
+
+    def _migrate_films_fts(self, cur):
+        _run_script(cur, _fts_script)
+        cur.execute("INSERT INTO films_fts (films_fts) VALUES ('delete-all')")
+        cur.execute(_fill_fts_script)
+
+    def _migrate_film_stats(self, cur):
+        _run_script(cur, _stats_script)
+        _run_script(cur, _rebuild_stats_script)
+
+    def _migrate_row_changes(self, cur):
+        _run_script(cur, _changes_script)
+
+    def _migrate_names(self, cur):
+        _run_script(cur, _names_script)
+
+    def close(self):
+        """сохранить изменения, оптимизировать и закрыть все соединения"""
+        if self._con is None:
+            return
+        # PRAGMA optimize пишет статистику; в режиме WAL чтение, ставшее
+        # записью, не ждёт другие процессы, поэтому запись занимается сразу
+        with self.transaction() as cur:
+            _run_script(cur, _exit_script)
         self._cur.close()
-        self.save()
         self._con.close()
+        self._con = None
+        with self._readers_lock:
+            for con in self._readers:
+                con.close()
+            self._readers.clear()
 
     def save(self):
         self._con.commit()
 
+    @_ctx.contextmanager
+    def transaction(self):
+        """всё или ничего: при исключении изменения внутри блока откатываются,
+        иначе сохраняются. Внешний блок сразу занимает запись (BEGIN IMMEDIATE)
+        и сохраняет изменения в конце, вложенный становится точкой сохранения"""
+        if self._con.in_transaction:
+            self._cur.execute("SAVEPOINT tx")
+            try:
+                yield self._cur
+            except BaseException:
+                self._cur.execute("ROLLBACK TO tx")
+                self._cur.execute("RELEASE tx")
+                raise
+            self._cur.execute("RELEASE tx")
+            return
+
+        self._cur.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._cur
+        except BaseException:
+            self._con.rollback()
+            raise
+        self.save()
+
     def get_table(self, name):
         return self._cur.execute("SELECT * FROM %s" % name).fetchall()
 
+    def rebuild_stats(self):
+        """пересчитать сводную статистику по продажам и вернуть расхождения
+        с представлением stats (пустой список, если их нет)"""
+        with self.transaction() as cur:
+            _run_script(cur, _rebuild_stats_script)
+        return self.check_stats()
+
+    def check_stats(self):
+        """строки (id фильма, билеты, прибыль) сводной статистики, которые
+        не совпадают с представлением stats, и наоборот"""
+        # составные операторы выполняются слева направо, поэтому каждая
+        # разность считается в своём подзапросе
+        self._cur.execute(
+            """SELECT * FROM (
+    SELECT film_id, tickets, profit FROM film_stats WHERE tickets > 0
+    EXCEPT SELECT id, tickets, profit FROM stats WHERE tickets > 0
+)
+UNION ALL
+SELECT * FROM (
+    SELECT id, tickets, profit FROM stats WHERE tickets > 0
+    EXCEPT SELECT film_id, tickets, profit FROM film_stats WHERE tickets > 0
+)"""
+        )
+        return self._cur.fetchall()
+
+    def get_report(self, start, end, bucket="day", group="film"):
+        """выручка и заполняемость сеансов с start по end (datetime, end не
+        включается) по интервалам bucket ("hour", "day", "week") и группам
+        group ("film", "show", "total"). Строки: (интервал, группа, сеансов,
+        мест, продано билетов, выручка). Результаты кэшируются по интервалам"""
+        self._check_report_cache()
+        intervals = [
+            (lo, hi, (bucket, group, dates.bucket_label(lo, bucket)))
+            for lo, hi in dates.buckets(start, end, bucket)
+        ]
+
+        missing = [i for i in intervals if i[2] not in self._report_cache]
+        while missing:
+            # соседние интервалы без кэша запрашиваются одним запросом
+            run = 1
+            while run < len(missing) and missing[run][0] == missing[run - 1][1]:
+                run += 1
+            self._load_report(missing[:run], bucket, group)
+            missing = missing[run:]
+
+        result = []
+        for _, _, key in intervals:
+            # запрошенные интервалы переносятся в конец, вытесняются первые
+            rows = self._report_cache[key] = self._report_cache.pop(key)
+            result += rows
+        while len(self._report_cache) > _report_cache_size:
+            del self._report_cache[next(iter(self._report_cache))]
+        return result
+
+    def _load_report(self, intervals, bucket, group):
+        key, group_by = _report_groups[group]
+        self._cur.execute(
+            _report_query % (_report_buckets[bucket], key, group_by),
+            (dates.from_date(intervals[0][0]), dates.from_date(intervals[-1][1])),
+        )
+        for _, _, cache_key in intervals:
+            self._report_cache[cache_key] = []
+        for row in self._cur.fetchall():
+            self._report_cache[(bucket, group, row[0])].append(row)
+
+    def _check_report_cache(self):
+        """сбросить кэш отчётов для интервалов, в которых изменились сеансы
+        или продажи; если что-то удалено или изменились фильмы (их названия
+        есть в отчётах), сбрасывается весь кэш"""
+        version = self.get_version()
+        if self._report_version is not None and version != self._report_version:
+            self._cur.execute(
+                """SELECT shows.time FROM row_changes as changes
+LEFT JOIN sales ON changes.tbl = 'sales' AND sales.id = changes.row_id
+LEFT JOIN tickets ON sales.ticket_id = tickets.id
+LEFT JOIN shows ON shows.id = iif(changes.tbl = 'shows', changes.row_id, tickets.show_id)
+WHERE changes.seq > ? AND changes.tbl IN ('sales', 'shows', 'films')""",
+                (self._report_version,),
+            )
+            times = {row[0] for row in self._cur.fetchall()}
+            if None in times:
+                self._report_cache.clear()
+            else:
+                labels = set()
+                for time in times:
+                    moment = dates.to_datetime(time)
+                    labels |= {
+                        (b, dates.bucket_label(moment, b)) for b in _report_buckets
+                    }
+                for key in [k for k in self._report_cache if (k[0], k[2]) in labels]:
+                    del self._report_cache[key]
+        self._report_version = version
+
+    def get_version(self):
+        result = self._cur.execute("SELECT MAX(seq) FROM row_changes").fetchone()[0]
+        return 0 if result is None else result
+
+    def get_rows(self, name, where=None):
+        """строки таблицы name, подходящие под условия where (см. _where_clause)"""
+        clause, args = _where_clause(where or [])
+        query = "SELECT * FROM %s" % name
+        if clause:
+            query += " WHERE " + clause
+        return self._cur.execute(query, args).fetchall()
+
+    def get_page(self, name, limit, key=None, op=">", where=None):
+        """до limit строк по порядку id, после (op ">" или ">=") или перед
+        (op "<") ключом key"""
+        where = list(where or [])
+        if key is not None:
+            where.append(("id", op, key))
+        clause, args = _where_clause(where)
+        query = "SELECT * FROM %s" % name
+        if clause:
+            query += " WHERE " + clause
+        query += " ORDER BY id %s LIMIT ?" % ("DESC" if op == "<" else "ASC")
+        rows = self._cur.execute(query, args + [limit]).fetchall()
+        return rows[::-1] if op == "<" else rows
+
+    def get_table_changes(self, name, since, where=None):
+        """(новая версия, id изменённых строк, изменённые строки) таблицы name
+        после версии since; id без строки означает удаление или несоответствие
+        условиям where"""
+        version = self.get_version()
+        table = _tracked_views.get(name, name)
+        self._cur.execute(
+            "SELECT row_id FROM row_changes WHERE seq > ? AND tbl = ?", (since, table)
+        )
+        ids = [row[0] for row in self._cur.fetchall()]
+        if not ids:
+            return version, ids, []
+        clause, args = _where_clause(where or [])
+        query = (
+            "SELECT * FROM %s WHERE id IN "
+            "(SELECT row_id FROM row_changes WHERE seq > ? AND tbl = ?)" % name
+        )
+        if clause:
+            query += " AND " + clause
+        self._cur.execute(query, [since, table] + args)
+        return version, ids, self._cur.fetchall()
+
     def execute(self, *args):
         return self._cur.execute(*args)
 
+    def get_films(self):
+        return self._cur.execute("SELECT %s FROM films" % _film_columns).fetchall()
+
+    def _reader(self):
+        """соединение для чтения в текущем потоке: основное в потоке,
+        создавшем Database, и отдельное в остальных"""
+        if _th.get_ident() == self._thread:
+            return self._con
+        con = getattr(self._local, "con", None)
+        if con is None:
+            # закрывается из потока, вызвавшего close
+            con = self._local.con = self._connect(check_same_thread=False)
+            with self._readers_lock:
+                self._readers.append(con)
+        return con
+
+    def open_poster(self, hash_, variant=None):
+        """картинка с хешем hash_ (вариант variant, если он есть) как
+        файлоподобный объект только для чтения, читается из базы по частям
+        без копирования целиком; можно вызывать из любого потока"""
+        con = self._reader()
+        if variant is not None:
+            row = con.execute(
+                "SELECT id FROM poster_variants WHERE hash = ? AND variant = ?",
+                (hash_, variant),
+            ).fetchone()
+            if row is not None:
+                return con.blobopen("poster_variants", "data", row[0], readonly=True)
+
+        row = con.execute("SELECT rowid FROM posters WHERE hash = ?", (hash_,))
+        (rowid,) = row.fetchone()
+        return con.blobopen("posters", "data", rowid, readonly=True)
+
+    def _store_poster(self, data):
+        """data - данные картинки или словарь {вариант: данные}"""
+        variants = data if isinstance(data, dict) else {_main_variant: data}
+        main = variants.get(_main_variant, next(iter(variants.values())))
+        hash_ = _poster_hash(main)
+        self._cur.execute("INSERT OR IGNORE INTO posters VALUES (?, ?)", (hash_, main))
+        self._cur.executemany(
+            "INSERT OR IGNORE INTO poster_variants (hash, variant, data) VALUES (?, ?, ?)",
+            [
+                (hash_, name, value)
+                for name, value in variants.items()
+                if value is not main
+            ],
+        )
+        return hash_
+
     def get_columns(self, table):
         self._cur.execute("SELECT name FROM PRAGMA_TABLE_INFO('%s')" % table)
         return [name[0] for name in self._cur.fetchall()]
@@ -117,10 +791,6 @@ class Database:
         )
         self.save()
 
-    def get_new_check_id(self):
-        result = self._cur.execute("SELECT MAX(id)+1 FROM checks").fetchone()[0]
-        return 1 if not result else result
-
     def get_show_tickets(self, show_id):
         self._cur.execute(
             "SELECT id, price, place FROM tickets WHERE show_id = ?", (show_id,)
@@ -131,47 +801,91 @@ class Database:
         self._cur.execute("SELECT ticket_id FROM sales")
         return self._cur.fetchall()
 
-    def sell_ticket(self, check_id, ticket_id, cost):
+    def get_show_seat_map(self, show_id):
+        """множество проданных мест сеанса"""
         self._cur.execute(
-            "INSERT INTO sales VALUES (NULL, ?, ?, ?)", (check_id, ticket_id, cost)
+            "SELECT place FROM tickets INNER JOIN sales ON sales.ticket_id = tickets.id "
+            "WHERE tickets.show_id = ?",
+            (show_id,),
         )
+        return {row[0] for row in self._cur.fetchall()}
 
-    def add_check(self, id_, sum_):
-        self._cur.execute("INSERT INTO checks VALUES (?, ?)", (id_, sum_))
+    def checkout(self, items):
+        """продать билеты items [(id билета, цена), ...] одним чеком.
+        Возвращает (номер чека, сумма); если какой-то билет уже продан,
+        не записывается ничего и выбрасывается sqlite3.IntegrityError"""
+        sales = list(items)
+        sum_ = sum(cost for _, cost in sales)
+        with self.transaction() as cur:
+            cur.execute("INSERT INTO checks (sum) VALUES (?) RETURNING id", (sum_,))
+            check_id = cur.fetchone()[0]
+            cur.executemany(
+                "INSERT INTO sales (check_id, ticket_id, cost) VALUES (?, ?, ?)",
+                [(check_id, ticket_id, cost) for ticket_id, cost in sales],
+            )
+        return check_id, sum_
 
     def return_check(self, id_):
-        self._cur.execute("DELETE FROM checks WHERE id = ?", (id_,))
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM checks WHERE id = ?", (id_,))
 
     def get_ticket_name(self, ticket_id):
+        self._cur.execute("SELECT name FROM ticket_names WHERE id = ?", (ticket_id,))
+        return self._cur.fetchone()[0]
+
+    def get_ticket_names(self, ids):
+        """{id билета: название} для всех билетов из ids одним запросом"""
         self._cur.execute(
-            "SELECT show_id, place FROM tickets WHERE id = ?", (ticket_id,)
+            "SELECT id, name FROM ticket_names "
+            "WHERE id IN (SELECT value FROM json_each(?))",
+            (_json.dumps(list(ids)),),
         )
-        show_id, place = self._cur.fetchone()
-        self._cur.execute("SELECT film_id, time FROM shows WHERE id = ?", (show_id,))
-        film_id, time = self._cur.fetchone()
-        self._cur.execute("SELECT name FROM films WHERE id = ?", (film_id,))
-        (name,) = self._cur.fetchone()
-        return "%s (%s, м. %d)" % (name, time, place)
-
-    def sell_ticket(self, check_id, ticket_id, cost):
+        return dict(self._cur.fetchall())
+
+    def count_sales(self, sale_ids, check_ids):
+        """количество продаж из sale_ids и из чеков check_ids"""
         self._cur.execute(
-            "INSERT INTO sales VALUES (NULL, ?, ?, ?)", (check_id, ticket_id, cost)
+            "SELECT COUNT(*) FROM sales "
+            "WHERE id IN (SELECT value FROM json_each(?)) "
+            "OR check_id IN (SELECT value FROM json_each(?))",
+            (_json.dumps(list(sale_ids)), _json.dumps(list(check_ids))),
         )
+        return self._cur.fetchone()[0]
 
     def return_sale(self, id_):
-        self._cur.execute("SELECT check_id, cost FROM sales WHERE id = ?", (id_,))
-        check_id, cost = self._cur.fetchone()
-        self._cur.execute("DELETE FROM sales WHERE id = ?", (id_,))
-        self._cur.execute(
-            "UPDATE checks SET sum = sum - ? WHERE id = ?", (cost, check_id)
-        )
+        self.return_sales([id_], [])
+
+    def return_sales(self, sale_ids, check_ids):
+        """вернуть продажи sale_ids и чеки check_ids целиком одной транзакцией;
+        суммы остальных чеков уменьшаются одним обновлением на чек"""
+        sales, checks = _json.dumps(list(sale_ids)), _json.dumps(list(check_ids))
+        with self.transaction() as cur:
+            cur.execute(
+                """UPDATE checks SET sum = sum - returned.cost
+FROM (
+    SELECT check_id, SUM(cost) as cost FROM sales
+    WHERE id IN (SELECT value FROM json_each(?))
+    GROUP BY check_id
+) as returned
+WHERE checks.id = returned.check_id""",
+                (sales,),
+            )
+            cur.execute(
+                "DELETE FROM sales WHERE id IN (SELECT value FROM json_each(?))",
+                (sales,),
+            )
+            cur.execute(
+                "DELETE FROM checks WHERE id IN (SELECT value FROM json_each(?))",
+                (checks,),
+            )
 
     def add_film(self, name, year, minutes, description, image_data):
         try:
-            self._cur.execute(
-                "INSERT INTO films VALUES (NULL, ?, ?, ?, ?, ?)",
-                (name, year, minutes, description, image_data),
-            )
+            with self.transaction() as cur:
+                cur.execute(
+                    "INSERT INTO films VALUES (NULL, ?, ?, ?, ?, ?)",
+                    (name, year, minutes, description, self._store_poster(image_data)),
+                )
             return True
         except:
             return False
@@ -179,45 +893,86 @@ class Database:
     def update_film(self, id_, name, year, minutes, description, image_data=None):
         args = (name, year, minutes, description)
         update_str = "name = ?, year = ?, duration_min = ?, description = ?"
-        if image_data is not None:
-            args += (image_data,)
-            update_str += ", image = ?"
 
         try:
-            self._cur.execute(
-                "UPDATE films SET %s WHERE id = ?" % update_str, args + (id_,)
-            )
-            self.save()
+            with self.transaction() as cur:
+                if image_data is not None:
+                    args += (self._store_poster(image_data),)
+                    update_str += ", poster = ?"
+                cur.execute(
+                    "UPDATE films SET %s WHERE id = ?" % update_str, args + (id_,)
+                )
             return True
         except Exception as e:
             print(e)
             return False
 
     def delete_film(self, id_):
-        self._cur.execute("DELETE FROM films WHERE id = ?", (id_,))
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM films WHERE id = ?", (id_,))
 
     def add_show(self, film_id, time, price):
-        self._cur.execute("INSERT INTO shows VALUES (NULL, ?, ?)", (film_id, time))
-        show_id = self._cur.execute("SELECT last_insert_rowid()").fetchone()[0]
-        for i in range(_cinema_places):
-            self.add_ticket(show_id, price, i)
-        return _cinema_places
+        return self.add_shows(film_id, [time], price)[1]
+
+    def add_shows(self, film_id, times, price):
+        """добавить сеансы фильма и все их билеты одной транзакцией;
+        если хоть одно время занято, не добавляется ничего.
+        Возвращает (количество сеансов, количество билетов)"""
+        with self.transaction() as cur:
+            show_ids = []
+            for time in times:
+                cur.execute(
+                    "INSERT INTO shows VALUES (NULL, ?, ?) RETURNING id",
+                    (film_id, time),
+                )
+                show_ids.append(cur.fetchone()[0])
+            cur.execute(
+                """INSERT INTO tickets (show_id, price, place)
+WITH RECURSIVE places(place) AS (
+    SELECT 0 UNION ALL SELECT place + 1 FROM places WHERE place + 1 < ?
+)
+SELECT shows.value, ?, places.place FROM json_each(?) as shows, places""",
+                (_cinema_places, int(price), _json.dumps(show_ids)),
+            )
+            tickets = cur.rowcount
+        return len(times), tickets
 
     def add_ticket(self, show_id, price, place):
-        self._cur.execute(
-            "INSERT INTO tickets VALUES (NULL, ?, ?, ?)", (show_id, price, place)
-        )
+        with self.transaction() as cur:
+            cur.execute(
+                "INSERT INTO tickets VALUES (NULL, ?, ?, ?)", (show_id, price, place)
+            )
 
     def delete_show(self, id_):
-        self._cur.execute("DELETE FROM shows WHERE id = ?", (id_,))
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM shows WHERE id = ?", (id_,))
 
     def get_film_shows(self, id_, time):
-        time = "%%%s%%" % time
+        if not time:
+            self._cur.execute("SELECT * FROM shows WHERE film_id = ?", (id_,))
+            return self._cur.fetchall()
         self._cur.execute(
-            "SELECT * FROM shows WHERE film_id = ? AND time LIKE ?", (id_, time)
+            "SELECT * FROM shows WHERE film_id = ? AND time >= ? AND time < ?",
+            (id_, *dates.prefix_range(time)),
         )
         return self._cur.fetchall()
 
+    def search_films(self, query, limit=None):
+        """id фильмов, в названии или описании которых есть слова, начинающиеся
+        со слов query, от наиболее подходящих (совпадения в названии весят
+        больше); не больше limit, если он задан"""
+        words = _re.findall(r"\w+", query.replace("ё", "е").replace("Ё", "Е"))
+        if not words:
+            return []
+
+        match = " ".join('"%s"*' % word for word in words)
+        self._cur.execute(
+            "SELECT rowid FROM films_fts WHERE films_fts MATCH ? "
+            "ORDER BY bm25(films_fts, ?, 1) LIMIT ?",
+            (match, _fts_name_weight, -1 if limit is None else limit),
+        )
+        return [row[0] for row in self._cur.fetchall()]
+
 
 """
     def add_product(self, *args):
@@ -282,3 +1037,48 @@ class Database:
     def reset_sales(self):
         self._cur.executescript("DELETE FROM sales; DELETE FROM checks;")
 """
+
+
+_shared = None
+
+
+def init_db(filename=_default_name, **kwargs):
+    """открыть общую для процесса базу, kwargs передаются в Database;
+    повторные вызовы возвращают уже открытую"""
+    global _shared
+    if _shared is None:
+        _shared = Database(filename, **kwargs)
+    return _shared
+
+
+def get_db():
+    """общая база, открытая init_db"""
+    if _shared is None:
+        raise RuntimeError("Database is not open")
+    return _shared
+
+
+def close_db():
+    global _shared
+    if _shared is not None:
+        _shared.close()
+        _shared = None
+
+
+def _main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Обслуживание базы кинотеатра")
+    parser.add_argument("command", choices=["rebuild-stats"])
+    parser.add_argument("filename", nargs="?", default=_default_name)
+    args = parser.parse_args()
+
+    with Database(args.filename) as db:
+        mismatches = db.rebuild_stats()
+    for row in mismatches:
+        print("Расхождение со stats: фильм %d, билетов %d, прибыль %d" % row)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
@@ -0,0 +1,199 @@
+import re as _re
+import sqlite3 as _sql
+import threading as _th
+import time as _time
+
+import dates
+
+__all__ = ["QueryProfiler", "normalize"]
+
+_default_log = "files/slow_queries.log"
+_threshold = 0.05  # с
+
+
+def normalize(sql):
+    """текст запроса без литералов и лишних пробелов, чтобы одинаковые
+    запросы с разными значениями считались вместе"""
+    sql = _re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = _re.sub(r"\b\d+\b", "?", sql)
+    return _re.sub(r"\s+", " ", sql).strip()
+
+
+def _full_scans(plan):
+    """таблицы, которые план (строки EXPLAIN QUERY PLAN) читает целиком без
+    индекса; просмотр результатов подзапросов, представлений и CTE
+    (MATERIALIZE, CO-ROUTINE) не считается"""
+    derived = {
+        detail.split(" ", 1)[1]
+        for detail in plan
+        if detail.startswith(("MATERIALIZE ", "CO-ROUTINE "))
+    }
+    return [
+        detail.split()[1]
+        for detail in plan
+        if detail.startswith("SCAN ")
+        and " USING " not in detail
+        and "VIRTUAL TABLE" not in detail
+        and detail != "SCAN CONSTANT ROW"
+        and detail.split()[1] not in derived
+    ]
+
+
+class _Stats:
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = self.slow = 0
+        self.total = self.max = 0.0
+        self.plan = None  # строки EXPLAIN QUERY PLAN первого медленного вызова
+
+    @property
+    def full_scan(self):
+        return bool(_full_scans(self.plan or []))
+
+
+class QueryProfiler:
+    """счётчики, суммарное и наибольшее время запросов по normalize(sql).
+    План запросов дольше threshold секунд записывается в log_file, полный
+    просмотр таблицы отмечается. Подключается через Database(profiler=...),
+    без него запросы выполняются как обычно"""
+
+    def __init__(self, threshold=_threshold, log_file=_default_log):
+        self.threshold = threshold
+        self.log_file = log_file
+        self._lock = _th.Lock()
+        self._stats = {}
+
+    def connect(self, *args, **kwargs):
+        """sqlite3.connect, все запросы соединения которого замеряются"""
+        con = _sql.connect(*args, factory=_Connection, **kwargs)
+        con.profiler = self
+        return con
+
+    def _record(self, cursor, seconds, new_call):
+        """добавить время вызова (new_call) или чтения его строк"""
+        cursor._elapsed = seconds if new_call else cursor._elapsed + seconds
+        with self._lock:
+            stats = self._stats.get(cursor._key)
+            if stats is None:
+                stats = self._stats[cursor._key] = _Stats(cursor._key)
+            if new_call:
+                stats.count += 1
+            stats.total += seconds
+            stats.max = max(stats.max, cursor._elapsed)
+            if cursor._elapsed < self.threshold or cursor._reported:
+                return
+            cursor._reported = True
+            stats.slow += 1
+            explain = stats.plan is None
+
+        if explain and cursor._params is not None:
+            stats.plan = self._explain(cursor.connection, cursor._text, cursor._params)
+        self._log(stats, cursor._elapsed)
+
+    def _explain(self, con, sql, params):
+        try:
+            plan = _sql.Cursor(con).execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in plan.fetchall()]
+        except _sql.Error:
+            return []
+
+    def _log(self, stats, seconds):
+        if not self.log_file:
+            return
+        lines = [
+            "%s %8.1f мс%s %s"
+            % (
+                dates.now(),
+                seconds * 1000,
+                " ПОЛНЫЙ ПРОСМОТР" if stats.full_scan else "",
+                stats.sql,
+            )
+        ]
+        lines += ["    " + detail for detail in stats.plan or []]
+        with self._lock, open(self.log_file, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def get_stats(self):
+        """[(запрос, вызовов, всего мс, макс. мс, медленных, полный просмотр,
+        план), ...] от самых долгих по сумме"""
+        with self._lock:
+            stats = sorted(self._stats.values(), key=lambda s: s.total, reverse=True)
+            return [
+                (
+                    s.sql,
+                    s.count,
+                    s.total * 1000,
+                    s.max * 1000,
+                    s.slow,
+                    s.full_scan,
+                    "; ".join(s.plan or []),
+                )
+                for s in stats
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class _Cursor(_sql.Cursor):
+    _key = _text = _params = None
+    _elapsed = 0.0
+    _reported = False
+
+    def _start(self, sql, params):
+        self._key, self._text, self._params = normalize(sql), sql, params
+        self._reported = False
+
+    def execute(self, sql, params=()):
+        self._start(sql, params)
+        start = _time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self.connection.profiler._record(self, _time.perf_counter() - start, True)
+
+    def executemany(self, sql, seq_of_params):
+        # план для нескольких наборов параметров не строится
+        self._start(sql, None)
+        start = _time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self.connection.profiler._record(self, _time.perf_counter() - start, True)
+
+    def executescript(self, script):
+        self._key = None
+        return super().executescript(script)
+
+    def _fetch(self, method, *args):
+        start = _time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._key is not None:
+                elapsed = _time.perf_counter() - start
+                self.connection.profiler._record(self, elapsed, False)
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+
+class _Connection(_sql.Connection):
+    profiler = None
+
+    def cursor(self, factory=_Cursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute создаёт обычный курсор
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
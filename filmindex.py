@@ -0,0 +1,114 @@
+import bisect as _bisect
+import collections as _col
+
+import dates
+
+__all__ = ["FilmIndex", "normalize"]
+
+
+def normalize(s):
+    return s.casefold().replace("ё", "е")
+
+
+def _trigrams(s):
+    return {s[i : i + 3] for i in range(len(s) - 2)}
+
+
+class FilmIndex:
+    """индекс названий фильмов (подстроки через триграммы) и времени сеансов
+    (отсортированный список для поиска по префиксу), обновляется по журналу
+    изменений базы"""
+
+    def __init__(self, db):
+        self._db = db
+        self._names = {}  # id фильма -> нормализованное название
+        self._trigrams = _col.defaultdict(set)
+        self._shows = {}  # id сеанса -> (время, id фильма)
+        self._times = []  # отсортированные (время, id фильма, id сеанса)
+        self._show_counts = _col.Counter()  # id фильма -> количество сеансов
+
+        self._version = db.get_version()
+        for film in db.get_films():
+            self._add_film(film[0], film[1])
+        for show_id, film_id, time in db.get_table("shows"):
+            self._add_show(show_id, film_id, time)
+        self._times.sort()
+
+    def _add_film(self, id_, name):
+        name = self._names[id_] = normalize(name)
+        for trigram in _trigrams(name):
+            self._trigrams[trigram].add(id_)
+
+    def _remove_film(self, id_):
+        name = self._names.pop(id_, None)
+        if name is None:
+            return
+        for trigram in _trigrams(name):
+            self._trigrams[trigram].discard(id_)
+            if not self._trigrams[trigram]:
+                del self._trigrams[trigram]
+
+    def _add_show(self, show_id, film_id, time, keep_sorted=False):
+        self._shows[show_id] = (time, film_id)
+        self._show_counts[film_id] += 1
+        if keep_sorted:
+            _bisect.insort(self._times, (time, film_id, show_id))
+        else:
+            self._times.append((time, film_id, show_id))
+
+    def _remove_show(self, show_id):
+        show = self._shows.pop(show_id, None)
+        if show is None:
+            return
+        time, film_id = show
+        self._show_counts[film_id] -= 1
+        if not self._show_counts[film_id]:
+            del self._show_counts[film_id]
+        i = _bisect.bisect_left(self._times, (time, film_id, show_id))
+        del self._times[i]
+
+    def refresh(self):
+        """применить изменения фильмов и сеансов с прошлого обновления"""
+        version = self._db.get_version()
+        if version == self._version:
+            return
+
+        _, ids, rows = self._db.get_table_changes("films", self._version)
+        for id_ in ids:
+            self._remove_film(id_)
+        for film in rows:
+            self._add_film(film[0], film[1])
+
+        _, ids, rows = self._db.get_table_changes("shows", self._version)
+        for id_ in ids:
+            self._remove_show(id_)
+        for show_id, film_id, time in rows:
+            self._add_show(show_id, film_id, time, True)
+
+        self._version = version
+
+    def _match_name(self, name):
+        name = normalize(name)
+        if len(name) < 3:
+            return {id_ for id_, n in self._names.items() if name in n}
+
+        candidates = None
+        for trigram in _trigrams(name):
+            ids = self._trigrams.get(trigram, set())
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return set()
+        return {id_ for id_ in candidates if name in self._names[id_]}
+
+    def _match_time(self, time):
+        if not time:
+            return set(self._show_counts)
+        lo, hi = dates.prefix_range(time)
+        start = _bisect.bisect_left(self._times, (lo,))
+        end = _bisect.bisect_left(self._times, (hi,))
+        return {film_id for _, film_id, _ in self._times[start:end]}
+
+    def search(self, name="", time=""):
+        """id фильмов, в названии которых есть name и у которых есть сеансы,
+        время которых начинается с time"""
+        return self._match_name(name) & self._match_time(time)
@@ -1,5 +1,5 @@
 import functools as _ft
-import io as _io
+import tkinter as _tk
 import tkinter.ttk as _ttk
 
 import images
@@ -7,52 +7,136 @@ import style
 
 __all__ = ["FilmView"]
 _columns = 4
+_tile_height = 350
+_poll_interval = 30
+
+
+class _Tile:
+    """кнопка фильма; пока картинка декодируется в фоне, future - её Future"""
+
+    def __init__(self, film, button):
+        self.film = film
+        self.button = button
+        self.image = self.future = None
 
 
 class FilmView(_ttk.Frame):
-    def __init__(self, master=None, db=None, on_click=None):
+    def __init__(self, master=None, db=None, on_click=None, tile_height=_tile_height):
         super().__init__(master)
         self._db = db
         self._on_click = on_click
-        self.images, self.buttons = [], []
+        self._variant = images.variant_for(tile_height)
+        self._placeholder = _tk.PhotoImage(
+            width=tile_height * 2 // 3, height=tile_height
+        )
+        self._label = _ttk.Label(self, text="Фильмы не найдены...")
+        # id фильма -> _Tile, кнопки живут между вызовами update
+        self._tiles = {}
+        self._polling = False
+        self.buttons = []
 
         self.update()
 
-    def _clear_children(self):
-        widgets = [w for w in self.children.values()]
-        [w.destroy() for w in widgets]
+    def _create_tile(self, film):
+        btn = style.Button(
+            self,
+            image=self._placeholder,
+            text=film[1],
+            compound="center",
+            command=_ft.partial(self._on_click, film),
+        )
+        btn.config(pad="1m")
+        return _Tile(film, btn)
 
-    def _add_label(self):
-        _ttk.Label(self, text="Фильмы не найдены...").grid(column=0, row=0)
+    def _destroy_tile(self, id_):
+        tile = self._tiles.pop(id_)
+        if tile.future is not None:
+            tile.future.cancel()
+        tile.button.destroy()
 
-    def update(self, filter=None):
-        self._clear_children()
-        self.images.clear()
-        self.buttons.clear()
+    def _hide_tile(self, tile):
+        tile.button.grid_remove()
+        # скрытые картинки не занимают очередь декодирования
+        if tile.future is not None and tile.future.cancel():
+            tile.future = None
+
+    def _load_poster(self, tile):
+        if tile.image is not None or tile.future is not None:
+            return
 
-        films = self._db.get_table("films")
-        if len(films) == 0:
-            self._add_label()
+        # film[-1] - хеш картинки, он же её версия
+        key = (tile.film[0], tile.film[-1], self._variant)
+        image = images.posters.get(key)
+        if image is not None:
+            tile.image = image
+            tile.button.config(image=image, compound="image")
             return
 
-        row, column = 0, 0
+        loader = _ft.partial(self._db.open_poster, tile.film[-1], self._variant)
+        tile.future = images.decode_async(loader)
+
+    def _start_polling(self):
+        if self._polling:
+            return
+        if any(tile.future is not None for tile in self._tiles.values()):
+            self._polling = True
+            self.after(_poll_interval, self._poll_pending)
+
+    def _poll_pending(self):
+        self._polling = False
+        for tile in self._tiles.values():
+            if tile.future is None or not tile.future.done():
+                continue
+            future, tile.future = tile.future, None
+            if future.cancelled():
+                continue
+
+            key = (tile.film[0], tile.film[-1], self._variant)
+            try:
+                tile.image = images.posters.put(
+                    key, images.to_photo_image(future.result())
+                )
+            except Exception:
+                continue
+            tile.button.config(image=tile.image, compound="image")
+
+        self._start_polling()
+
+    def update(self, filter=None, order=None):
+        """показать фильмы, подходящие под filter; фильмы с id из списка order
+        идут первыми в его порядке. Кнопки создаются только для новых
+        и изменённых фильмов, остальные переставляются или скрываются;
+        картинки подставляются по мере декодирования в порядке сетки"""
+        films = self._db.get_films()
+        if order:
+            positions = {id_: i for i, id_ in enumerate(order)}
+            films.sort(key=lambda film: positions.get(film[0], len(positions)))
+        ids = {film[0] for film in films}
+        for id_ in [i for i in self._tiles if i not in ids]:
+            self._destroy_tile(id_)
+
+        self.buttons = []
         for film in films:
+            tile = self._tiles.get(film[0])
+            if tile is not None and tile.film != film:
+                self._destroy_tile(film[0])
+                tile = None
+
             if callable(filter) and not filter(film):
+                if tile is not None:
+                    self._hide_tile(tile)
                 continue
 
-            image = images.get_photo_image(film[-1])
-            btn = style.Button(
-                self, image=image, command=_ft.partial(self._on_click, film)
-            )
-            btn.config(pad="1m")
-            btn.grid(column=column, row=row)
-            column += 1
-            if column >= _columns:
-                column = 0
-                row += 1
-
-            self.images.append(image)
-            self.buttons.append(btn)
-
-        if column == 0 and row == 0:  # no films were added
-            self._add_label()
+            if tile is None:
+                tile = self._tiles[film[0]] = self._create_tile(film)
+            position = len(self.buttons)
+            tile.button.grid(column=position % _columns, row=position // _columns)
+            self._load_poster(tile)
+            self.buttons.append(tile.button)
+
+        if self.buttons:
+            self._label.grid_remove()
+        else:
+            self._label.grid(column=0, row=0)
+
+        self._start_polling()
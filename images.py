@@ -1,10 +1,38 @@
+import collections as _col
+import concurrent.futures as _fut
 import io as _io
+import json as _json
+import multiprocessing as _mp
 
 import PIL.Image as _image
 import PIL.ImageTk as _imageTk
 
-__all__ = ["is_image", "create_thumbnail", "get_photo_image"]
+__all__ = [
+    "is_image",
+    "create_thumbnail",
+    "prepare_thumbnail",
+    "submit_thumbnails",
+    "is_image_file",
+    "init_variants",
+    "create_variants",
+    "variant_for",
+    "decode_async",
+    "to_photo_image",
+    "PhotoCache",
+    "posters",
+]
 _thumbnail_height = 350
+_default_config = "files/posters.json"
+# варианты картинок фильма: высота (None - исходный размер), формат и качество
+_variants = {
+    "small": {"height": 200, "format": "JPEG", "quality": 80},
+    "medium": {"height": _thumbnail_height, "format": "JPEG", "quality": 85},
+}
+_cache_size = 128
+_extensions = (".jpg", ".jpeg", ".png")
+_executor = None
+_decoder = None
+_decode_workers = 2
 
 
 def is_image(filename):
@@ -16,17 +44,120 @@ def is_image(filename):
         return False
 
 
-def create_thumbnail(filename):
+def init_variants(filename=_default_config):
+    global _variants
+    try:
+        with open(filename) as f:
+            _variants = _json.load(f)
+    except FileNotFoundError:
+        pass
+
+
+def create_thumbnail(filename, height=_thumbnail_height, format="PNG", quality=None):
     img = _image.open(filename)
-    width = int(_thumbnail_height * img.width / img.height)
-    img.thumbnail((width, _thumbnail_height), _image.ANTIALIAS)
+    if height is not None:
+        width = int(height * img.width / img.height)
+        img.thumbnail((width, height), _image.LANCZOS)
+    if format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
 
     result = _io.BytesIO()
-    img.save(result, format="PNG")
+    options = {} if quality is None else {"quality": quality}
+    img.save(result, format=format, **options)
     data = result.getvalue()
     return data
 
 
-def get_photo_image(data):
-    img = _image.open(_io.BytesIO(data))
+def create_variants(filename, variants):
+    return {name: create_thumbnail(filename, **spec) for name, spec in variants.items()}
+
+
+def variant_for(height):
+    """наименьший вариант картинки высотой не меньше height"""
+    sizes = sorted(
+        (spec["height"] or float("inf"), name) for name, spec in _variants.items()
+    )
+    for size, name in sizes:
+        if size >= height:
+            return name
+    return sizes[-1][1]
+
+
+def prepare_thumbnail(filename, variants):
+    """проверить картинку и создать её варианты {название: данные};
+    None, если это не картинка"""
+    if not is_image(filename):
+        return None
+    try:
+        return create_variants(filename, variants)
+    except Exception:
+        return None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, чтобы рабочие процессы не наследовали состояние Tk
+        _executor = _fut.ProcessPoolExecutor(mp_context=_mp.get_context("spawn"))
+    return _executor
+
+
+def submit_thumbnails(filenames):
+    """запустить prepare_thumbnail для каждого файла в пуле процессов,
+    вернуть список Future"""
+    return [_get_executor().submit(prepare_thumbnail, f, _variants) for f in filenames]
+
+
+def is_image_file(filename):
+    return filename.lower().endswith(_extensions)
+
+
+def _decode(loader):
+    with loader() as data:
+        img = _image.open(data)
+        img.load()
+    return img
+
+
+def decode_async(loader):
+    """декодировать картинку из loader() в фоновом потоке, вернуть Future
+    с PIL.Image; PhotoImage из него создаётся в потоке Tk (to_photo_image)"""
+    global _decoder
+    if _decoder is None:
+        _decoder = _fut.ThreadPoolExecutor(_decode_workers)
+    return _decoder.submit(_decode, loader)
+
+
+def to_photo_image(img):
     return _imageTk.PhotoImage(img)
+
+
+class PhotoCache:
+    """LRU-кэш PhotoImage, ключ - (id фильма, версия картинки, ...)"""
+
+    def __init__(self, maxsize=_cache_size):
+        self._maxsize = maxsize
+        self._items = _col.OrderedDict()
+
+    def get(self, key):
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, image):
+        self._items[key] = image
+        self._items.move_to_end(key)
+        if len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+        return image
+
+    def discard(self, id_):
+        for key in [k for k in self._items if k[0] == id_]:
+            del self._items[key]
+
+    def clear(self):
+        self._items.clear()
+
+
+posters = PhotoCache()
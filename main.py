@@ -1,22 +1,35 @@
 #!/usr/bin/env python3
+import os
 import sys
 
 import admin
 import cashier
+import dbprofile
+import images
 import logo
 import style
 import util
 import window
-from db_sqlite import Database
+from db_sqlite import close_db, init_db
 from login import Login, Roles
 
 
+def _create_profiler():
+    """CINEMA_PROFILE=<мс> включает замеры запросов; запросы дольше
+    стольких миллисекунд записываются в журнал медленных запросов"""
+    threshold = os.environ.get("CINEMA_PROFILE")
+    if not threshold:
+        return None
+    return dbprofile.QueryProfiler(float(threshold) / 1000)
+
+
 class MainWindow(window.RootWindow):
     def __init__(self):
         super().__init__("Кинотеатр")
         logo.create_image()
         style.init_style()
-        self._db = Database()
+        images.init_variants()
+        self._db = init_db(profiler=_create_profiler())
         self.create_widgets()
 
     def create_widgets(self):
@@ -59,7 +72,10 @@ class MainWindow(window.RootWindow):
 
 def run():
     root = MainWindow()
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        close_db()
 
 
 if __name__ == "__main__":
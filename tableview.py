@@ -1,5 +1,8 @@
 import tkinter.ttk as _ttk
 
+# сколько страниц держать в виджете в постраничном режиме
+_window_pages = 3
+
 
 class TableView(_ttk.Treeview):
     def __init__(
@@ -10,14 +13,30 @@ class TableView(_ttk.Treeview):
         columns=None,
         on_select=None,
         row_func=None,
+        incremental=False,
+        where=None,
+        page_size=None,
     ):
+        """where - условия выборки для Database.get_rows или функция, которая
+        их возвращает; row_func применяется после неё к каждой строке.
+        incremental - обновлять только изменившиеся строки, первый столбец
+        таблицы должен быть первичным ключом.
+        page_size - держать в виджете только несколько страниц по первичному
+        ключу и подгружать следующие при прокрутке (использует yscrollcommand)"""
         super().__init__(master)
 
         self.db = db
         self.table = table
         self._row_func = row_func
+        self._where = where
+        self._incremental = incremental
+        self._version = None
+        self._page_size = page_size
+        self._at_start = self._at_end = True
 
         self.config(columns=columns)
+        if page_size:
+            self.config(yscrollcommand=self._on_scroll)
 
         self.column("#0", width=0, stretch="no")
         self.heading("#0", text="")
@@ -34,19 +53,119 @@ class TableView(_ttk.Treeview):
     def clear_selection(self):
         self.selection_remove(self.selection())
 
+    def _prepare_row(self, row):
+        row = tuple(str(x) for x in row)
+        if self._row_func is not None:
+            row = self._row_func(row)
+        return row
+
+    def _insert_row(self, row, index="end"):
+        values = self._prepare_row(row)
+        if not values:
+            return
+        if self._incremental or self._page_size:
+            self.insert("", index, iid=row[0], values=values)
+        else:
+            self.insert("", index, values=values)
+
+    def _get_where(self):
+        if callable(self._where):
+            return self._where()
+        return self._where
+
     def update_data(self):
         if not self.db or not self.table:
             return
+        if self._incremental and self._version is not None:
+            return self._update_changed()
+
+        if self._incremental:
+            self._version = self.db.get_version()
+        if self._page_size:
+            return self._load_window()
 
         self.clear()
+        for row in self.db.get_rows(self.table, self._get_where()):
+            self._insert_row(row)
+
+    def _in_window(self, id_):
+        if not self._page_size:
+            return True
+        children = self.get_children()
+        if not children:
+            return True
+        if not self._at_start and id_ < int(children[0]):
+            return False
+        if not self._at_end and id_ > int(children[-1]):
+            return False
+        return True
+
+    def _update_changed(self):
+        self._version, ids, rows = self.db.get_table_changes(
+            self.table, self._version, self._get_where()
+        )
+        rows = {row[0]: row for row in rows}
+        for id_ in ids:
+            values = self._prepare_row(rows[id_]) if id_ in rows else None
+            if not values:
+                if self.exists(id_):
+                    self.delete(id_)
+            elif self.exists(id_):
+                self.item(id_, values=values)
+            elif self._in_window(id_):
+                self.insert("", "end", iid=id_, values=values)
+
+    def _get_page(self, key=None, op=">"):
+        return self.db.get_page(self.table, self._page_size, key, op, self._get_where())
+
+    def _load_window(self, key=None, op=">"):
+        self.clear()
+        rows = self._get_page(key, op)
+        self._at_start = key is None
+        self._at_end = len(rows) < self._page_size
+        for row in rows:
+            self._insert_row(row)
+
+    def _on_scroll(self, first, last):
+        if float(last) >= 1.0 and not self._at_end:
+            self._load_more(True)
+        elif float(first) <= 0.0 and not self._at_start:
+            self._load_more(False)
+
+    def _load_more(self, forward):
+        children = self.get_children()
+        if not children:
+            return
+        key = int(children[-1] if forward else children[0])
+        rows = self._get_page(key, ">" if forward else "<")
+        excess = len(children) + len(rows) - _window_pages * self._page_size
+
+        if forward:
+            self._at_end = len(rows) < self._page_size
+            for row in rows:
+                self._insert_row(row)
+            if excess > 0:
+                self.delete(*children[:excess])
+                self._at_start = False
+            self.see(key)
+        else:
+            self._at_start = len(rows) < self._page_size
+            for row in reversed(rows):
+                self._insert_row(row, 0)
+            if excess > 0:
+                self.delete(*children[-excess:])
+                self._at_end = False
+            self.yview_moveto(len(rows) / len(self.get_children()))
 
-        for row in self.db.get_table(self.table):
-            row = tuple(str(x) for x in row)
-            if self._row_func is not None:
-                row = self._row_func(row)
-                if not row:
-                    continue
-            self.insert("", "end", values=row)
+    def jump_to(self, key):
+        """загрузить страницу, начинающуюся с ключа key, и выделить его строку"""
+        self._load_window(key, ">=")
+        self._at_start = False
+        if not self.exists(key):
+            return False
+        self.selection_set(key)
+        self.see(key)
+        return True
 
     def on_select(self, event, func):
         if func is None:
@@ -0,0 +1,5 @@
+import os as _os
+import sys as _sys
+
+# модули приложения лежат в корне репозитория
+_sys.path.insert(0, _os.path.dirname(_os.path.dirname(_os.path.abspath(__file__))))
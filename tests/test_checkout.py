@@ -0,0 +1,70 @@
+"""продажа из нескольких процессов в одну базу WAL, как с нескольких касс"""
+
+import multiprocessing as _mp
+import sqlite3 as _sql
+
+import bench
+from db_sqlite import Database
+
+_processes = 4
+_per_check = 2
+
+
+def _sell(filename, tickets):
+    """продать tickets чеками по _per_check билетов: (номера чеков, ошибки)"""
+    check_ids, failures = [], []
+    with Database(filename) as db:
+        for i in range(0, len(tickets), _per_check):
+            items = [(id_, bench._price) for id_ in tickets[i : i + _per_check]]
+            try:
+                check_ids.append(db.checkout(items)[0])
+            except _sql.Error as e:
+                failures.append(repr(e))
+    return check_ids, failures
+
+
+def _edit_shows(filename, film_id, count):
+    """добавлять и удалять сеансы, пока кассы продают билеты"""
+    failures = []
+    other = _sql.connect(filename)
+    with Database(filename) as db:
+        for i in range(count):
+            try:
+                db.add_show(film_id, "2100-01-01 %02d:%02d" % divmod(i, 60), 100)
+                show_id = db.execute("SELECT MAX(id) FROM shows").fetchone()[0]
+                db.delete_show(show_id)
+            except _sql.Error as e:
+                failures.append(repr(e))
+                continue
+            # удаление сохранено и не держит запись до закрытия базы
+            query = "SELECT COUNT(*) FROM shows WHERE id = ?"
+            if other.execute(query, (show_id,)).fetchone()[0]:
+                failures.append("show %d is not deleted" % show_id)
+    other.close()
+    return [], failures
+
+
+def test_checkout_from_processes(tmp_path):
+    filename = str(tmp_path / "cinema.sqlite3")
+    with Database(filename) as db:
+        bench.generate(db, films=5, shows_per_day=4, days=5, sales_ratio=0)
+        tickets = [row[0] for row in db.execute("SELECT id FROM tickets")]
+        film_id = db.get_films()[0][0]
+
+    jobs = [(_sell, (filename, tickets[i::_processes])) for i in range(_processes)]
+    jobs.append((_edit_shows, (filename, film_id, 50)))
+    with _mp.get_context("spawn").Pool(len(jobs)) as pool:
+        results = [pool.apply_async(func, args) for func, args in jobs]
+        results = [result.get(timeout=60) for result in results]
+
+    check_ids = [id_ for ids, _ in results for id_ in ids]
+    assert [failure for _, failures in results for failure in failures] == []
+    assert len(check_ids) == len(set(check_ids))
+
+    with Database(filename) as db:
+        assert db.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == len(tickets)
+        assert sorted(check_ids) == [
+            row[0] for row in db.execute("SELECT id FROM checks ORDER BY id")
+        ]
+        assert db.execute("SELECT COUNT(*) FROM shows").fetchone()[0] == 4 * 5
+        assert db.check_stats() == []
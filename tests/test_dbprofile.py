@@ -0,0 +1,32 @@
+"""поиск полного просмотра таблиц в планах QueryProfiler"""
+
+import bench
+import dbprofile
+from db_sqlite import Database
+
+
+def _stats(profiler, sql):
+    return next(s for s in profiler.get_stats() if s[0] == dbprofile.normalize(sql))
+
+
+def test_full_scan(tmp_path):
+    profiler = dbprofile.QueryProfiler(threshold=0, log_file=None)
+    with Database(str(tmp_path / "cinema.sqlite3"), profiler=profiler) as db:
+        bench.generate(db, films=2, shows_per_day=1, days=2)
+        profiler.reset()
+
+        db.add_show(db.get_films()[0][0], "2100-01-01 10:00", 100)
+        db.get_table("stats")
+        scan = "SELECT * FROM sales as s WHERE cost > ?"
+        db.execute(scan, (0,)).fetchall()
+        search = "SELECT * FROM shows WHERE film_id = ?"
+        db.execute(search, (1,)).fetchall()
+
+        stats = profiler.get_stats()
+        insert = next(s for s in stats if s[0].startswith("INSERT INTO tickets"))
+        # просмотр CTE places не считается
+        assert "SCAN places" in insert[6] and not insert[5]
+        # SCAN stats - результат представления, но внутри оно читает все shows
+        assert _stats(profiler, "SELECT * FROM stats")[5]
+        assert _stats(profiler, scan)[5]
+        assert not _stats(profiler, search)[5]
@@ -0,0 +1,201 @@
+"""миграции базы, созданной исходной схемой (картинки в films.image,
+чеки без AUTOINCREMENT). Размер базы задаётся переменными окружения
+CINEMA_TEST_FILMS и CINEMA_TEST_SHOWS (сеансов на фильм), например
+CINEMA_TEST_FILMS=100 CINEMA_TEST_SHOWS=200 - 400 тыс. билетов"""
+
+import datetime as _dt
+import os as _os
+import random as _random
+import sqlite3 as _sql
+
+import pytest
+
+import dates
+import db_sqlite
+from db_sqlite import Database
+
+_places = 20
+_films = int(_os.environ.get("CINEMA_TEST_FILMS", 30))
+_shows_per_film = int(_os.environ.get("CINEMA_TEST_SHOWS", 5))
+_images = 5
+# сеансы фильмов идут по очереди каждые 10 минут
+_first_show = _dt.datetime(2022, 1, 1, 0, 0)
+
+_baseline_script = """
+PRAGMA foreign_keys = 1;
+PRAGMA journal_mode = WAL;
+
+CREATE TABLE films (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    year INTEGER NOT NULL,
+    duration_min INTEGER NOT NULL CHECK(duration_min >= 0),
+    description TEXT NOT NULL,
+    image BLOB NOT NULL
+) STRICT;
+
+CREATE TABLE shows (
+    id INTEGER PRIMARY KEY,
+    film_id INTEGER NOT NULL,
+    time TEXT NOT NULL UNIQUE,
+    FOREIGN KEY(film_id) REFERENCES films(id) ON DELETE CASCADE
+) STRICT;
+
+CREATE TABLE tickets (
+    id INTEGER PRIMARY KEY,
+    show_id INTEGER NOT NULL,
+    price INTEGER NOT NULL DEFAULT 0 CHECK(price >= 0),
+    place INTEGER NOT NULL CHECK(place >= 0 AND place < %d),
+    FOREIGN KEY(show_id) REFERENCES shows(id) ON DELETE CASCADE
+) STRICT;
+
+CREATE TABLE checks (
+    id INTEGER PRIMARY KEY,
+    sum INTEGER NOT NULL DEFAULT 0 CHECK(sum >= 0)
+) STRICT;
+
+CREATE TABLE sales (
+    id INTEGER PRIMARY KEY,
+    check_id INTEGER NOT NULL,
+    ticket_id INTEGER NOT NULL UNIQUE,
+    cost INTEGER NOT NULL DEFAULT 0 CHECK(cost >= 0),
+    FOREIGN KEY(check_id) REFERENCES checks(id) ON DELETE CASCADE,
+    FOREIGN KEY(ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
+) STRICT;
+
+CREATE TABLE logins (
+    login TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    role TEXT NOT NULL DEFAULT "cashier"
+) STRICT;
+
+CREATE VIEW stats AS
+SELECT films.id as id, films.name as name, COUNT(ticket_id) as tickets, SUM(cost) as profit
+FROM sales
+INNER JOIN tickets ON sales.ticket_id = tickets.id
+INNER JOIN shows ON tickets.show_id = shows.id
+INNER JOIN films ON shows.film_id = films.id
+GROUP BY films.id
+ORDER BY profit DESC;
+""" % (_places)
+
+
+def _create_baseline(filename, seed=1):
+    """база исходной схемы: _films фильмов с повторяющимися картинками,
+    _shows_per_film сеансов на фильм, продано 80% билетов; возвращает
+    количество продаж"""
+    rnd = _random.Random(seed)
+    images = [rnd.randbytes(2048) for _ in range(_images)]
+    con = _sql.connect(filename)
+    con.executescript(_baseline_script)
+    with con:
+        con.executemany(
+            "INSERT INTO films VALUES (?, ?, 2000, 90, ?, ?)",
+            [
+                (i, "Фильм %d" % i, "описание %d" % i, images[i % _images])
+                for i in range(1, _films + 1)
+            ],
+        )
+        con.executemany(
+            "INSERT INTO shows VALUES (NULL, ?, ?)",
+            [
+                (
+                    film_id,
+                    dates.from_date(
+                        _first_show
+                        + _dt.timedelta(minutes=10 * (day * _films + film_id))
+                    ),
+                )
+                for film_id in range(1, _films + 1)
+                for day in range(_shows_per_film)
+            ],
+        )
+        con.executemany(
+            "INSERT INTO tickets (show_id, price, place) VALUES (?, 300, ?)",
+            [
+                (show_id, place)
+                for (show_id,) in con.execute("SELECT id FROM shows").fetchall()
+                for place in range(_places)
+            ],
+        )
+        tickets = [row[0] for row in con.execute("SELECT id FROM tickets")]
+        sold = rnd.sample(tickets, len(tickets) * 4 // 5)
+        check_rows, sale_rows = [], []
+        while len(sale_rows) < len(sold):
+            items = sold[len(sale_rows) : len(sale_rows) + rnd.randint(1, 4)]
+            check_rows.append((len(check_rows) + 1, len(items) * 300))
+            sale_rows += [(len(check_rows), ticket_id) for ticket_id in items]
+        con.executemany("INSERT INTO checks VALUES (?, ?)", check_rows)
+        con.executemany("INSERT INTO sales VALUES (NULL, ?, ?, 300)", sale_rows)
+        sales = con.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+    con.close()
+    return sales
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    filename = str(tmp_path / "cinema.sqlite3")
+    return filename, _create_baseline(filename)
+
+
+def test_migrate_baseline(baseline):
+    filename, sales = baseline
+    with Database(filename) as db:
+        assert db.execute("PRAGMA user_version").fetchone()[0] == len(
+            db_sqlite._migrations
+        )
+        assert db.execute("PRAGMA foreign_key_check").fetchall() == []
+        assert db.check_stats() == []
+
+        # пересоздание таблиц не удалило продажи каскадом
+        assert db.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == sales
+        assert "image" not in db.get_columns("films")
+        assert db.execute("SELECT COUNT(*) FROM posters").fetchone()[0] == _images
+        assert (
+            db.execute(
+                "SELECT COUNT(DISTINCT poster) FROM films WHERE poster IS NOT NULL"
+            ).fetchone()[0]
+            == _images
+        )
+
+        sql = db.execute("SELECT sql FROM sqlite_schema WHERE name = 'checks'")
+        assert "AUTOINCREMENT" in sql.fetchone()[0]
+        assert 7 in db.search_films("фильм 7")
+
+
+def test_migrate_once(baseline):
+    filename, _ = baseline
+    Database(filename).close()
+    with Database(filename) as db:
+        rows = db.execute("SELECT version, name FROM schema_migrations").fetchall()
+        assert rows == list(enumerate(db_sqlite._migrations, 1))
+
+
+def test_failed_migration_keeps_version(baseline, monkeypatch):
+    filename, sales = baseline
+
+    def fail(self, cur):
+        cur.execute("DELETE FROM sales")
+        raise _sql.OperationalError("migration failed")
+
+    monkeypatch.setattr(Database, "_migrate_checks_autoincrement", fail)
+    with pytest.raises(_sql.OperationalError):
+        Database(filename)
+
+    con = _sql.connect(filename)
+    # миграции до упавшей сохранены, упавшая откачена целиком
+    assert con.execute("PRAGMA user_version").fetchone()[0] == 2
+    assert con.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == sales
+    con.close()
+
+
+def _schema(db):
+    return db.execute(
+        "SELECT type, name, tbl_name FROM sqlite_schema ORDER BY type, name"
+    ).fetchall()
+
+
+def test_new_database_matches_migrated(baseline, tmp_path):
+    filename, _ = baseline
+    with Database(filename) as old, Database(str(tmp_path / "new.sqlite3")) as new:
+        assert _schema(new) == _schema(old)
@@ -0,0 +1,56 @@
+"""кэш отчётов Database.get_report"""
+
+import datetime as _dt
+
+import pytest
+
+import bench
+import db_sqlite
+from db_sqlite import Database
+
+_today = _dt.datetime.combine(_dt.date.today(), _dt.time())
+# сеансы bench.generate за последние дни
+_start, _end = _today - _dt.timedelta(days=14), _today + _dt.timedelta(days=1)
+
+
+@pytest.fixture
+def db(tmp_path):
+    with Database(str(tmp_path / "cinema.sqlite3")) as db:
+        bench.generate(db, films=3, shows_per_day=2, days=10, sales_ratio=0.5)
+        yield db
+
+
+def _uncached(db, *args):
+    db._report_cache.clear()
+    return db.get_report(*args)
+
+
+def test_report_after_rename(db):
+    report = db.get_report(_start, _end, "week")
+    film_id, name = db.get_films()[0][:2]
+    assert name in {row[1] for row in report}
+
+    db.update_film(film_id, "Новое название", 2000, 90, "описание")
+    report = db.get_report(_start, _end, "week")
+    assert name not in {row[1] for row in report}
+    assert report == _uncached(db, _start, _end, "week")
+
+
+def test_report_after_sale(db):
+    db.get_report(_start, _end, "day", "total")
+    ticket_id = db.execute(
+        "SELECT id FROM tickets WHERE id NOT IN (SELECT ticket_id FROM sales)"
+    ).fetchone()[0]
+    db.checkout([(ticket_id, 1000)])
+    report = db.get_report(_start, _end, "day", "total")
+    assert report == _uncached(db, _start, _end, "day", "total")
+
+
+def test_report_cache_size(db, monkeypatch):
+    monkeypatch.setattr(db_sqlite, "_report_cache_size", 50)
+    hours = db.get_report(_start, _end, "hour", "total")
+    assert len(db._report_cache) == 50
+    # запрошенный последним отчёт остаётся в кэше целиком
+    assert db.get_report(_start, _end, "day", "total")
+    assert all(key[0] == "day" for key in list(db._report_cache)[-15:])
+    assert hours == _uncached(db, _start, _end, "hour", "total")
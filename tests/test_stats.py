@@ -0,0 +1,43 @@
+"""сводная статистика film_stats и её сверка с представлением stats"""
+
+import pytest
+
+import bench
+from db_sqlite import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    with Database(str(tmp_path / "cinema.sqlite3")) as db:
+        bench.generate(db, films=4, shows_per_day=2, days=3, sales_ratio=0.5)
+        yield db
+
+
+def test_stats_match(db):
+    assert db.check_stats() == []
+    assert db.rebuild_stats() == []
+
+
+def test_check_stats_reports_both_sides(db):
+    sold = {row[0] for row in db.execute("SELECT id FROM stats")}
+    film_id, tickets, profit = db.execute(
+        "SELECT id, tickets, profit FROM stats ORDER BY id LIMIT 1"
+    ).fetchone()
+    db.add_film("Без продаж", 2000, 90, "описание", b"poster")
+    phantom = db.execute("SELECT MAX(id) FROM films").fetchone()[0]
+    assert phantom not in sold
+
+    with db.transaction() as cur:
+        cur.execute("INSERT OR REPLACE INTO film_stats VALUES (?, 3, 900)", (phantom,))
+        cur.execute(
+            "UPDATE film_stats SET tickets = tickets + 1 WHERE film_id = ?",
+            (film_id,),
+        )
+    assert sorted(db.check_stats()) == sorted(
+        [
+            (phantom, 3, 900),
+            (film_id, tickets + 1, profit),
+            (film_id, tickets, profit),
+        ]
+    )
+    assert db.rebuild_stats() == []
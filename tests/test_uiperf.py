@@ -0,0 +1,38 @@
+"""сценарии uiperf целиком; нужен X-сервер:
+xvfb-run -a python -m pytest tests/test_uiperf.py"""
+
+import os as _os
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    not _os.environ.get("DISPLAY"), reason="нужен X-сервер (xvfb-run)"
+)
+
+_steps = 13
+
+
+def test_flows(tmp_path):
+    import bench
+    import db_sqlite
+    import uiperf
+
+    cwd = _os.getcwd()
+    root = uiperf.init_ui()
+    db = db_sqlite.init_db(str(tmp_path / "ui.sqlite3"))
+    try:
+        bench.generate(db, 8, 3, 5, 0.5, 1, uiperf._poster)
+        checks = db.execute("SELECT COUNT(*) FROM checks").fetchone()[0]
+        report = uiperf.run(root, db, repeat=1)
+
+        assert report["errors"] == []
+        assert len(report["steps"]) == _steps
+        assert all(step["count"] == 1 for step in report["steps"].values())
+        # проданный в сценарии чек возвращён
+        assert any(text.startswith("Чек №") for text in report["messages"])
+        assert db.execute("SELECT COUNT(*) FROM checks").fetchone()[0] == checks
+        assert db.check_stats() == []
+    finally:
+        db_sqlite.close_db()
+        root.destroy()
+        _os.chdir(cwd)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""замеры интерфейса кассира и администратора на сгенерированной базе,
+запускается под Xvfb: xvfb-run -a python3 uiperf.py --output ui.json"""
+
+import argparse as _arg
+import io as _io
+import json as _json
+import os as _os
+import platform as _platform
+import tempfile as _tmp
+import time as _time
+import tkinter as _tk
+import tkinter.messagebox as _msg
+import tkinter.ttk as _ttk
+
+import admin
+import bench
+import cashier
+import db_sqlite
+import filmview
+import images
+import logo
+import style
+import tableview
+import util
+
+__all__ = ["init_ui", "run"]
+
+_heartbeat = 10  # мс
+_settle_timeout = 10  # с
+_repeat = 5
+
+
+class _Monitor:
+    """время шагов, самая долгая пауза цикла событий Tk и количество
+    созданных и удалённых виджетов и строк Treeview в FilmView.update
+    и TableView.update_data"""
+
+    def __init__(self, root):
+        self._root = root
+        self._last = self._max_gap = 0
+        self._patched = []
+        self.steps = {}  # шаг -> [(время, пауза), ...]
+        self.calls = {}  # метод -> счётчики
+        self._counts = dict.fromkeys(
+            ["widgets_created", "widgets_destroyed", "rows_inserted", "rows_deleted"],
+            0,
+        )
+        self._tick()
+
+    def _tick(self):
+        now = _time.perf_counter()
+        if self._last:
+            self._max_gap = max(self._max_gap, now - self._last)
+        self._last = now
+        self._root.after(_heartbeat, self._tick)
+
+    def _patch(self, cls, name, wrapper):
+        original = getattr(cls, name)
+        self._patched.append((cls, name, original))
+        setattr(cls, name, wrapper(original))
+
+    def _count(self, key, amount=1):
+        self._counts[key] += amount
+
+    def install(self):
+        counts = self._count
+
+        def created(original):
+            def wrapper(widget, *args, **kwargs):
+                counts("widgets_created")
+                return original(widget, *args, **kwargs)
+
+            return wrapper
+
+        def destroyed(original):
+            def wrapper(widget):
+                counts("widgets_destroyed")
+                return original(widget)
+
+            return wrapper
+
+        def inserted(original):
+            def wrapper(tree, *args, **kwargs):
+                counts("rows_inserted")
+                return original(tree, *args, **kwargs)
+
+            return wrapper
+
+        def deleted(original):
+            def wrapper(tree, *items):
+                counts("rows_deleted", len(items))
+                return original(tree, *items)
+
+            return wrapper
+
+        self._patch(_tk.BaseWidget, "__init__", created)
+        self._patch(_tk.BaseWidget, "destroy", destroyed)
+        self._patch(_ttk.Treeview, "insert", inserted)
+        self._patch(_ttk.Treeview, "delete", deleted)
+        self._patch(filmview.FilmView, "update", self._measured("FilmView.update"))
+        self._patch(
+            tableview.TableView, "update_data", self._measured("TableView.update_data")
+        )
+
+    def uninstall(self):
+        for cls, name, original in reversed(self._patched):
+            setattr(cls, name, original)
+        self._patched.clear()
+
+    def _measured(self, name):
+        stats = self.calls.setdefault(
+            name, dict(calls=0, seconds=0.0, **dict.fromkeys(self._counts, 0))
+        )
+
+        def wrap(original):
+            def wrapper(obj, *args, **kwargs):
+                before = dict(self._counts)
+                start = _time.perf_counter()
+                try:
+                    return original(obj, *args, **kwargs)
+                finally:
+                    stats["calls"] += 1
+                    stats["seconds"] += _time.perf_counter() - start
+                    for key, value in self._counts.items():
+                        stats[key] += value - before[key]
+
+            return wrapper
+
+        return wrap
+
+    def settle(self, done=None):
+        """обрабатывать события, пока не выполнится done()"""
+        deadline = _time.perf_counter() + _settle_timeout
+        while True:
+            self._root.update()
+            if done is None or done() or _time.perf_counter() > deadline:
+                return
+            _time.sleep(_heartbeat / 1000 / 2)
+
+    def step(self, name, func, done=None):
+        self.settle()
+        self._last, self._max_gap = _time.perf_counter(), 0
+        start = _time.perf_counter()
+        result = func()
+        self.settle(done)
+        self.steps.setdefault(name, []).append(
+            (_time.perf_counter() - start, self._max_gap)
+        )
+        return result
+
+
+def _posters_loaded(view):
+    return lambda: all(tile.future is None for tile in view._tiles.values())
+
+
+def _type(monitor, win, entry, text):
+    """набрать text в entry по символу, как при вводе с клавиатуры"""
+    entry.focus_force()
+    entry.delete(0, "end")
+    for char in text:
+        entry.insert("end", char)
+        entry.event_generate("<KeyRelease>")
+        monitor.settle()
+    monitor.settle(lambda: win._search_job is None)
+
+
+def _cashier_flow(monitor, db):
+    win = monitor.step("cashier: открыть", cashier.Cashier)
+    view = win._film_view
+    monitor.settle(_posters_loaded(view))
+
+    monitor.step(
+        "cashier: поиск по названию",
+        lambda: _type(monitor, win, win._film_name, "фильм 1"),
+        _posters_loaded(view),
+    )
+    monitor.step("cashier: сброс поиска", win._reset_search, _posters_loaded(view))
+
+    monitor.step("cashier: выбор сеанса", view.buttons[0].invoke)
+    win._close_show_selector()
+
+    def add_tickets():
+        for _ in range(3):
+            view.buttons[0].invoke()
+            if win._show_selector is None:
+                return
+            first = win._shows.get_children()[0]
+            win._select_ticket(None, win._shows.item(first))
+            buttons = win._ticket_selector.winfo_children()[-1].winfo_children()
+            enabled = [b for b in buttons if "disabled" not in b.state()]
+            if not enabled:
+                return win._close_ticket_selector()
+            enabled[0].invoke()
+            monitor.settle()
+
+    monitor.step("cashier: добавление билетов", add_tickets)
+    monitor.step("cashier: продажа", win._on_sell)
+
+    check_id = db.execute("SELECT MAX(id) FROM checks").fetchone()[0]
+
+    def return_check():
+        win._checks.jump_to(check_id)
+        win._on_return_sales()
+
+    monitor.step("cashier: возврат чека", return_check)
+    monitor.step("cashier: обновление продаж", win._update_sales)
+    win.destroy()
+
+
+def _admin_flow(monitor, db):
+    win = monitor.step("admin: открыть", admin.Admin)
+    view = win._film_view
+    monitor.settle(_posters_loaded(view))
+
+    monitor.step(
+        "admin: поиск",
+        lambda: _type(monitor, win, win._film_query, "фильм 2"),
+        _posters_loaded(view),
+    )
+
+    def show_editor():
+        win._film_id = db.get_films()[0][0]
+        win._create_show_editor(None)
+
+    monitor.step("admin: редактор сеансов", show_editor)
+    win._film_editor.destroy()
+    win._film_editor = None
+
+    monitor.step("admin: пересчёт статистики", win._rebuild_stats)
+
+    def report():
+        first = db.execute("SELECT MIN(time) FROM shows").fetchone()[0]
+        win._report_start.delete(0, "end")
+        win._report_start.insert(0, first[:10])
+        win._show_report()
+
+    monitor.step("admin: отчёт", report)
+    win.destroy()
+
+
+def _poster(i):
+    """варианты картинки-заглушки своего цвета для каждого фильма, как их
+    создаёт администратор при добавлении фильма"""
+    from PIL import Image
+
+    buffer = _io.BytesIO()
+    color = (i * 37 % 256, i * 91 % 256, i * 53 % 256)
+    Image.new("RGB", (233, 350), color).save(buffer, "PNG")
+    return {
+        name: images.create_thumbnail(_io.BytesIO(buffer.getvalue()), **spec)
+        for name, spec in images._variants.items()
+    }
+
+
+def init_ui():
+    """корневое окно и ресурсы интерфейса, как при запуске main.py;
+    пути к files/ относительные, поэтому рабочая папка - папка программы"""
+    _os.chdir(_os.path.dirname(_os.path.abspath(__file__)))
+    root = _tk.Tk()
+    root.withdraw()
+    logo.create_image()
+    style.init_style()
+    images.init_variants()
+    return root
+
+
+def run(root, db, repeat=_repeat):
+    """пройти сценарии кассира и администратора repeat раз"""
+    # диалоги не ждут ответа, а подтверждения всегда положительные
+    messages, errors = [], []
+    dialogs = util.show_error, util.show_info, _msg.askyesno
+    util.show_error = lambda text: errors.append(text) or False
+    util.show_info = lambda text: messages.append(text) or True
+    _msg.askyesno = lambda *_: True
+
+    monitor = _Monitor(root)
+    monitor.install()
+    try:
+        for _ in range(repeat):
+            _cashier_flow(monitor, db)
+            _admin_flow(monitor, db)
+    finally:
+        monitor.uninstall()
+        util.show_error, util.show_info, _msg.askyesno = dialogs
+
+    steps = {}
+    for name, samples in monitor.steps.items():
+        steps[name] = bench.summarize([wall for wall, _ in samples])
+        steps[name]["block_max"] = max(gap for _, gap in samples) * 1000
+    for stats in monitor.calls.values():
+        stats["ms"] = stats.pop("seconds") * 1000
+    return {
+        "steps": steps,
+        "widgets": monitor.calls,
+        "messages": messages,
+        "errors": errors,
+    }
+
+
+def _print_report(report):
+    print("%-34s %9s %9s %12s" % ("шаг", "p50, мс", "max, мс", "пауза, мс"))
+    for name, r in report["steps"].items():
+        print("%-34s %9.1f %9.1f %12.1f" % (name, r["p50"], r["max"], r["block_max"]))
+    print()
+    print(
+        "%-22s %7s %9s %9s %9s %9s %9s"
+        % ("метод", "вызовов", "мс", "создано", "удалено", "+строк", "-строк")
+    )
+    for name, r in report["widgets"].items():
+        print(
+            "%-22s %7d %9.1f %9d %9d %9d %9d"
+            % (
+                name,
+                r["calls"],
+                r["ms"],
+                r["widgets_created"],
+                r["widgets_destroyed"],
+                r["rows_inserted"],
+                r["rows_deleted"],
+            )
+        )
+
+
+def _main():
+    parser = _arg.ArgumentParser(description="Замеры интерфейса кинотеатра")
+    parser.add_argument("--films", type=int, default=40)
+    parser.add_argument("--shows-per-day", type=int, default=5)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--sales-ratio", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=_repeat)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=bench._threshold)
+    args = parser.parse_args()
+    if args.films < 1 or args.shows_per_day < 1:
+        parser.error("нужны хотя бы один фильм и один сеанс в день")
+    if not 0 <= args.sales_ratio <= 1:
+        parser.error("--sales-ratio должен быть от 0 до 1")
+
+    if not _os.environ.get("DISPLAY"):
+        print("Нужен X-сервер, например: xvfb-run -a python3 uiperf.py")
+        return 2
+
+    config = {
+        "films": args.films,
+        "shows_per_day": args.shows_per_day,
+        "days": args.days,
+        "sales_ratio": args.sales_ratio,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+    root = init_ui()
+    with _tmp.TemporaryDirectory() as tmp:
+        db = db_sqlite.init_db(_os.path.join(tmp, "ui.sqlite3"))
+        try:
+            bench.generate(
+                db,
+                args.films,
+                args.shows_per_day,
+                args.days,
+                args.sales_ratio,
+                args.seed,
+                _poster,
+            )
+            report = run(root, db, args.repeat)
+        finally:
+            db_sqlite.close_db()
+    root.destroy()
+
+    _print_report(report)
+    report.update(
+        config=config,
+        python=_platform.python_version(),
+        tk=_tk.TkVersion,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            _json.dump(report, f, indent=4, ensure_ascii=False)
+
+    # сообщение об ошибке значит, что сценарий прошёл не до конца
+    # и его время нельзя сравнивать
+    for text in report["errors"]:
+        print("Ошибка: %s" % text)
+    if report["errors"]:
+        return 1
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        old = _json.load(f)
+    regressions = bench.compare(old["steps"], report["steps"], args.threshold)
+    for name, before, after in regressions:
+        print("Регрессия: %s, p50 %.1f -> %.1f мс" % (name, before, after))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
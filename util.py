@@ -1,6 +1,7 @@
 import tkinter.messagebox as _msg
 
 __all__ = ["set_close_handler"]
+_poll_interval = 50
 
 
 def set_close_handler(win, func):
@@ -22,3 +23,18 @@ def center_window(win):
     x = (win.winfo_screenwidth() - w) // 2
     y = (win.winfo_screenheight() - h) // 2
     win.geometry("+%d+%d" % (x, y))
+
+
+def poll_futures(widget, futures, on_done, on_progress=None):
+    """проверять futures через widget.after, не блокируя цикл событий Tk;
+    on_progress(готово, всего) вызывается при каждой проверке,
+    on_done(futures) - когда готовы все"""
+    done = sum(f.done() for f in futures)
+    if on_progress is not None:
+        on_progress(done, len(futures))
+    if done < len(futures):
+        widget.after(
+            _poll_interval, poll_futures, widget, futures, on_done, on_progress
+        )
+    else:
+        on_done(futures)